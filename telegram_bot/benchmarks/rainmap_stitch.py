@@ -0,0 +1,126 @@
+"""
+Micro-benchmark of rainmap stitching.
+
+Compares the original stitch (convert, resize, putalpha and two pastes per
+frame) with Weather._composite, which blends each overlay into the
+precomposed base layers with a single Image.composite(). Synthetic images of the same size as the
+weather.gov.sg layers are used, no network access is needed.
+
+    Usage (from telegram_bot/):
+
+    python -m benchmarks.rainmap_stitch [--frames 50]
+
+The encoded size and encode time of a frame are also shown for some
+RAINMAP_ENCODING settings.
+
+"""
+import time
+import argparse
+
+import numpy as np
+
+import utils.api.methods  # noqa: F401, imported before objects
+from PIL import Image
+from modules.weather import Weather, CONFIG, RAINMAP_OVERLAY_ALPHA
+
+ENCODINGS = [
+    {"FORMAT": "png", "COMPRESS_LEVEL": 6},
+    {"FORMAT": "png", "COMPRESS_LEVEL": 1},
+    {"FORMAT": "png", "PALETTE_COLORS": 64, "COMPRESS_LEVEL": 6},
+    {"FORMAT": "jpeg", "QUALITY": 80},
+    {"FORMAT": "webp", "QUALITY": 80},
+]
+
+BASE_SIZE = (853, 479)
+OVERLAY_SIZE = (217, 120)
+
+
+def synthetic_layers(seed: int = 0):
+    """Base map, township layer and radar overlays"""
+
+    rng = np.random.default_rng(seed)
+
+    base = Image.fromarray(
+        rng.integers(0, 256, (BASE_SIZE[1], BASE_SIZE[0], 3), dtype=np.uint8), "RGB")
+
+    # Mostly transparent township outlines
+    town = np.zeros((BASE_SIZE[1] // 2, BASE_SIZE[0] // 2, 4), dtype=np.uint8)
+    town[::8, :, :] = 255
+    town[:, ::8, :] = 255
+    town = Image.fromarray(town, "RGBA")
+
+    def overlay():
+        image = Image.fromarray(
+            rng.integers(0, 8, (OVERLAY_SIZE[1], OVERLAY_SIZE[0]), dtype=np.uint8), "P")
+        image.putpalette(rng.integers(0, 256, 256 * 3, dtype=np.uint8).tolist())
+        return image
+
+    return base, town, overlay
+
+
+def legacy_composite(base: Image.Image, town: Image.Image, overlay: Image.Image) -> Image.Image:
+    """Stitch as done before the base layers were precomposed"""
+
+    base = base.convert("RGBA")
+    town = town.resize(base.size).convert("RGBA")
+    overlay = overlay.resize(base.size).convert("RGBA")
+    overlay.putalpha(RAINMAP_OVERLAY_ALPHA)
+    base.paste(overlay, (0, 0), overlay)
+    base.paste(town, (0, 0), town)
+
+    return base
+
+
+def timed(fn, overlays) -> float:
+    """Mean ms per call"""
+
+    start = time.perf_counter()
+
+    for overlay in overlays:
+        fn(overlay)
+
+    return (time.perf_counter() - start) * 1000 / len(overlays)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--frames", type=int, default=50)
+    args = parser.parse_args()
+
+    base, town, make_overlay = synthetic_layers()
+    overlays = [make_overlay() for _ in range(args.frames)]
+
+    Weather._static_layers = (base, town)
+
+    start = time.perf_counter()
+    Weather._get_base_layers()
+    setup_ms = (time.perf_counter() - start) * 1000
+
+    legacy = timed(lambda o: legacy_composite(base, town, o), overlays)
+    precomposed = timed(Weather._composite, overlays)
+
+    diff = np.abs(
+        np.asarray(legacy_composite(base, town, overlays[0]), dtype=np.int16) -
+        np.asarray(Weather._composite(overlays[0]), dtype=np.int16)).max()
+
+    print(f"frames: {args.frames}, size: {BASE_SIZE[0]}x{BASE_SIZE[1]}")
+    print(f"legacy stitch:      {legacy:8.2f} ms/frame")
+    print(f"precomposed blend: {precomposed:8.2f} ms/frame "
+          f"(x{legacy / precomposed:.1f}, one-off setup {setup_ms:.1f} ms)")
+    print(f"max pixel difference: {diff}")
+
+    frame = Weather._composite(overlays[0])
+    defaults = dict(CONFIG["RAINMAP_ENCODING"])
+
+    for encoding in ENCODINGS:
+        CONFIG["RAINMAP_ENCODING"] = {**defaults, "PALETTE_COLORS": 0, **encoding}
+        encode = timed(lambda _: Weather._encode(frame), overlays[:5])
+        size = len(Weather._encode(frame))
+
+        print(f"encode {encoding}: {encode:.1f} ms, {size / 1024:.0f} KiB")
+
+    CONFIG["RAINMAP_ENCODING"] = defaults
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Registry of short tokens standing in for the callback data of buttons.
+
+Telegram limits the callback_data of an inline keyboard button to 64 bytes.
+Callback data longer than MAX_INLINE_LENGTH is stored in the callback_token
+table and replaced by a short token, which is resolved back to the stored
+data when the button is pressed. Tokens are derived from the data, so
+rendering the same keyboard again reuses its tokens. Tokens expire TTL
+seconds after they were last registered and are deleted by the database
+maintenance task.
+
+    Typical usage example:
+
+    import core.callbacks as callbacks
+
+    callbacks.setup("config.json")
+    token = callbacks.register("/weather forecast24 ...")
+    data = callbacks.resolve(token)  # None once expired
+
+"""
+import json
+import time
+import base64
+import hashlib
+import threading
+
+from core import database as db
+from utils.cache import LRUCache
+import utils.api.methods  # Must be imported before utils.api.objects
+from utils.api.objects import InlineKeyboardMarkup
+
+# Marks callback data that is a token, commands never start with it
+TOKEN_PREFIX = "#"
+
+# Max length in bytes of callback_data allowed by telegram
+MAX_CALLBACK_DATA = 64
+
+CONFIG = {
+    "MAX_INLINE_LENGTH": 32,
+    "TTL": 30 * 24 * 3600,
+    "CACHE_SIZE": 10000,
+}
+
+_cache = LRUCache(CONFIG["CACHE_SIZE"])
+_lock = threading.Lock()
+
+_stats = {
+    "registered": 0,
+    "resolved": 0,
+    "expired": 0,
+}
+
+
+def setup(config_path: str) -> None:
+    """
+    Configure the registry using a config file, purge expired tokens and
+    register the tokens of long button data from now on
+
+    Args:
+        config_path: path to a JSON config file
+
+    Returns:
+        None
+
+    Raises:
+        IOError: Config file cannot be read
+        json.JSONDecodeError: Invaild JSON
+        sqlite3.OperationalError: Database not connected
+    """
+    global _cache
+
+    with open(config_path) as f:
+        CONFIG.update(json.load(f).get("callbacks", {}))
+
+    CONFIG["MAX_INLINE_LENGTH"] = min(
+        CONFIG["MAX_INLINE_LENGTH"], MAX_CALLBACK_DATA)
+
+    _cache = LRUCache(CONFIG["CACHE_SIZE"])
+
+    purge()
+    db.register_maintenance("callback_token", purge)
+
+    InlineKeyboardMarkup.set_data_encoder(register)
+
+
+def _token(data: str) -> str:
+    digest = hashlib.sha256(data.encode()).digest()[:12]
+    return TOKEN_PREFIX + base64.urlsafe_b64encode(digest).decode()
+
+
+def register(data: str) -> str:
+    """
+    Get the callback_data to send for a button
+
+    Args:
+        data: data received when the button is pressed, usually a command
+
+    Returns:
+        data itself if short enough, else a token for it
+
+    Raises:
+        sqlite3.Error: Database error
+    """
+
+    if not data.startswith(TOKEN_PREFIX) and len(data.encode()) <= CONFIG["MAX_INLINE_LENGTH"]:
+        return data
+
+    token = _token(data)
+
+    # Registered recently, the row has at least half of its TTL left
+    if _cache.get(token) == data:
+        return token
+
+    db.execute_and_commit(
+        """
+        INSERT INTO callback_token (token, data, expires) VALUES (?, ?, ?)
+        ON CONFLICT (token) DO UPDATE SET data = excluded.data, expires = excluded.expires
+        """,
+        (token, data, time.time() + CONFIG["TTL"])
+    )
+
+    _cache.set(token, data, ttl=CONFIG["TTL"] / 2)
+
+    with _lock:
+        _stats["registered"] += 1
+
+    return token
+
+
+def resolve(callback_data: str):
+    """
+    Get the data of a pressed button
+
+    Args:
+        callback_data: callback_data received from telegram
+
+    Returns:
+        the registered data, callback_data if it is not a token, None if
+        the token has expired or is unknown
+
+    Raises:
+        sqlite3.Error: Database error
+    """
+
+    if not callback_data or not callback_data.startswith(TOKEN_PREFIX):
+        return callback_data
+
+    data = _cache.get(callback_data)
+
+    if data is None:
+        now = time.time()
+        rows = db.execute(
+            "SELECT data, expires FROM callback_token WHERE token = ? AND expires > ?",
+            (callback_data, now))
+
+        if rows == []:
+            with _lock:
+                _stats["expired"] += 1
+
+            return None
+
+        data, expires = rows[0]
+        _cache.set(callback_data, data, ttl=min(expires - now, CONFIG["TTL"] / 2))
+
+    with _lock:
+        _stats["resolved"] += 1
+
+    return data
+
+
+def purge() -> int:
+    """
+    Delete expired tokens, run by the database maintenance task
+
+    Returns:
+        number of tokens deleted
+    """
+
+    rows = db.execute_and_commit(
+        "DELETE FROM callback_token WHERE expires <= ? RETURNING token", (time.time(),))
+
+    return len(rows)
+
+
+def stats() -> dict:
+    """
+    Get counters of the registry
+
+    Returns:
+        dict of token counters and cache counters
+    """
+
+    with _lock:
+        result = dict(_stats)
+
+    result["cache"] = _cache.stats()
+
+    return result
@@ -0,0 +1,310 @@
+"""
+Shared HTTP client for calls to the telegram Bot API.
+
+This module keeps one requests.Session with a pool of keep-alive
+connections to api.telegram.org so that the connection and TLS session are
+reused across all calls made by the project.
+
+Calls sending to a chat (calls with a chat_id) are rate limited to stay
+within telegram's flood limits. Calls answered with 429 are delayed by the
+given retry_after and sent again instead of failing.
+
+    Typical usage example:
+
+    import core.client as client
+
+    client.setup("config.json")
+    r = client.post(token, "sendMessage", params={"chat_id": 1, "text": "hi"})
+    client.stats()
+
+"""
+import json
+import time
+import threading
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
+
+from utils.api.ratelimit import RateLimiter
+
+API_URL = "https://api.telegram.org"
+
+# Methods that can safely be sent again if the outcome is unknown
+IDEMPOTENT_METHODS = frozenset({
+    "getMe",
+    "getUpdates",
+    "setWebhook",
+    "deleteWebhook",
+    "getWebhookInfo",
+    "setMyCommands",
+})
+
+RETRY_STATUS = frozenset({500, 502, 503, 504})
+
+CONFIG = {
+    "POOL_SIZE": 16,
+    "CONNECT_TIMEOUT": 5,
+    "READ_TIMEOUT": 30,
+    "RETRIES": 3,
+    "BACKOFF": 0.5,
+    "GLOBAL_PER_SECOND": 30,
+    "CHAT_PER_SECOND": 1,
+    "CHAT_BURST": 3,
+    "GROUP_PER_MINUTE": 20,
+    "RATE_LIMIT_RETRIES": 5,
+}
+
+_session = None
+_adapter = None
+_limiter = None
+_lock = threading.Lock()
+
+_stats = {
+    "requests": 0,
+    "retries": 0,
+    "errors": 0,
+    "total_time": 0.0,
+}
+
+
+def setup(config_path: str) -> None:
+    """
+    Configure the client using a config file
+
+    Args:
+        config_path: path to a JSON config file
+
+    Returns:
+        None
+
+    Raises:
+        IOError: Config file cannot be read
+        json.JSONDecodeError: Invaild JSON
+    """
+
+    with open(config_path) as f:
+        configure(**json.load(f).get("api", {}))
+
+
+def configure(**kwargs) -> None:
+    """
+    Update the client settings and recreate the session
+
+    Args:
+        **POOL_SIZE: max connections kept open to the Bot API
+        **CONNECT_TIMEOUT: seconds to wait for a connection
+        **READ_TIMEOUT: seconds to wait for a response
+        **RETRIES: max retries of a failed call
+        **BACKOFF: backoff factor between retries in seconds
+        **GLOBAL_PER_SECOND: max messages sent per second
+        **CHAT_PER_SECOND, CHAT_BURST: max messages per second to a chat
+        **GROUP_PER_MINUTE: max messages per minute to a group
+        **RATE_LIMIT_RETRIES: max resends of a message answered with 429
+    """
+    global _session
+    global _limiter
+
+    with _lock:
+        CONFIG.update(kwargs)
+
+        if _session is not None:
+            _session.close()
+            _session = None
+
+        _limiter = None
+
+
+def get_session() -> requests.Session:
+    """
+    Get the shared session, created on first use
+
+    Returns:
+        requests.Session
+    """
+    global _session
+    global _adapter
+
+    with _lock:
+        if _session is None:
+            # Only retry connection errors here, the request was not sent
+            retry = Retry(
+                total=CONFIG["RETRIES"],
+                connect=CONFIG["RETRIES"],
+                read=0,
+                status=0,
+                redirect=0,
+                backoff_factor=CONFIG["BACKOFF"]
+            )
+
+            _adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=CONFIG["POOL_SIZE"],
+                max_retries=retry
+            )
+
+            _session = requests.Session()
+            _session.mount(API_URL, _adapter)
+
+        return _session
+
+
+def get_limiter() -> RateLimiter:
+    """
+    Get the shared rate limiter, created on first use
+
+    Returns:
+        RateLimiter
+    """
+    global _limiter
+
+    with _lock:
+        if _limiter is None:
+            _limiter = RateLimiter(
+                global_rate=CONFIG["GLOBAL_PER_SECOND"],
+                global_burst=CONFIG["GLOBAL_PER_SECOND"],
+                chat_rate=CONFIG["CHAT_PER_SECOND"],
+                chat_burst=CONFIG["CHAT_BURST"],
+                group_rate=CONFIG["GROUP_PER_MINUTE"] / 60,
+                group_burst=CONFIG["GROUP_PER_MINUTE"]
+            )
+
+        return _limiter
+
+
+def _retry_after(r: requests.Response) -> float:
+    """Get retry_after of a 429 response"""
+
+    try:
+        return float(r.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return 1.0
+
+
+def post(token: str, method: str, params=None, files=None, json=None, timeout=None) -> requests.Response:
+    """
+    Call a Bot API method
+
+    Calls to methods in IDEMPOTENT_METHODS are retried with backoff on
+    timeouts and server errors. Calls with a chat_id wait for the rate
+    limiter and are resent after the retry_after of a 429 response.
+
+    Args:
+        token: telegram bot token
+        method: name of the method
+            -> see https://core.telegram.org/bots/api/#available-methods
+        params (optional): url parameters
+        files (optional): files to upload
+        json (optional): json body
+        timeout (optional): (connect, read) timeout, defaults to config
+
+    Returns:
+        requests.Response
+
+    Raises:
+        requests.RequestException: The call failed after all retries
+    """
+
+    session = get_session()
+
+    if timeout is None:
+        timeout = (CONFIG["CONNECT_TIMEOUT"], CONFIG["READ_TIMEOUT"])
+
+    retries = CONFIG["RETRIES"] if method in IDEMPOTENT_METHODS else 0
+    attempt = 0
+    throttled = 0
+
+    chat_id = (params or json or {}).get("chat_id")
+    limiter = get_limiter() if chat_id is not None else None
+
+    while True:
+        if limiter is not None:
+            limiter.acquire(chat_id)
+
+        start = time.perf_counter()
+
+        try:
+            r = session.post(
+                url=f'{API_URL}/bot{token}/{method}',
+                params=params,
+                files=files,
+                json=json,
+                timeout=timeout
+            )
+
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _count(time.perf_counter() - start, error=True)
+
+            # Connection errors were already retried by the adapter
+            if attempt >= retries or (e.args and isinstance(e.args[0], MaxRetryError)):
+                raise
+
+        else:
+            _count(time.perf_counter() - start, error=r.status_code >= 400)
+
+            if r.status_code == 429 and limiter is not None and throttled < CONFIG["RATE_LIMIT_RETRIES"]:
+                # Requeued behind the limiter until retry_after has passed
+                limiter.retry_after(chat_id, _retry_after(r))
+                throttled += 1
+                continue
+
+            if attempt >= retries or r.status_code not in RETRY_STATUS:
+                return r
+
+        attempt += 1
+
+        with _lock:
+            _stats["retries"] += 1
+
+        time.sleep(CONFIG["BACKOFF"] * (2 ** (attempt - 1)))
+
+
+def _count(elapsed: float, error: bool) -> None:
+
+    with _lock:
+        _stats["requests"] += 1
+        _stats["total_time"] += elapsed
+
+        if error:
+            _stats["errors"] += 1
+
+
+def stats() -> dict:
+    """
+    Get counters of the client and its connection pool
+
+    Returns:
+        dict of request counters and open connections
+    """
+
+    with _lock:
+        result = dict(_stats)
+        result["pool_size"] = CONFIG["POOL_SIZE"]
+        result["avg_time"] = round(
+            _stats["total_time"] / _stats["requests"], 4) if _stats["requests"] else 0.0
+
+        pools = []
+
+        if _session is not None:
+            manager = _adapter.poolmanager
+
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+
+                if pool is None:
+                    continue
+
+                pools.append({
+                    "host": pool.host,
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    "idle_connections": sum(
+                        1 for conn in pool.pool.queue if conn is not None) if pool.pool is not None else 0,
+                })
+
+        result["pools"] = pools
+
+    result["rate_limit"] = get_limiter().stats()
+
+    return result
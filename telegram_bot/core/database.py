@@ -1,8 +1,24 @@
 """
 Interface for executing sql instruction on local SQLite3 database. 
 
-This moudule allow for the sharing of one database connection to be 
-used across the the whole project.
+This moudule allow for the sharing of database connections to be 
+used across the the whole project. Each thread leases its own connection
+from a pool, connections of threads that have exited are returned to the
+pool and reused. The database is opened in WAL mode so that readers do not
+block the writer.
+
+Writes that only need to be durable eventually (e.g. session state) can be
+deferred with execute_deferred(). Deferred writes to the same key are
+merged and committed together in one transaction by a background flusher.
+
+A background maintenance task expires stale session rows, runs registered
+cleanup tasks, returns free pages to the file system with incremental
+vacuum and checkpoints the WAL every MAINTENANCE["INTERVAL"] seconds.
+
+With PROFILING enabled, the latency and rows returned of statements run by
+execute(), execute_and_commit(), transaction() cursors and the write-behind
+flush are recorded per normalized statement, statements slower than
+SLOW_QUERY_MS are logged with their query plan.
 
     Typical usage example:
 
@@ -13,11 +29,133 @@ used across the the whole project.
     db.execute_and_commit("INSERT INTO table VALUE (...)"
     
 """
+import re
 import json
+import time
 import atexit
+import logging
 import sqlite3
-
-_connection = None
+import threading
+
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger(__name__ + ".slow")
+
+DEFAULT_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -8000,
+    "mmap_size": 0,
+}
+
+_db_path = None
+_pragmas = {}
+_busy_timeout = 5000
+_pool_size = 8
+
+_lock = threading.Lock()
+_local = threading.local()
+_generation = 0
+_idle: list[sqlite3.Connection] = []
+_open: set[sqlite3.Connection] = set()
+
+# Write-behind of deferred statements
+WRITE_BEHIND = {
+    "ENABLED": False,
+    "INTERVAL": 0.05,
+    "BATCH_SIZE": 100,
+    "MAX_BACKOFF": 5,
+    "MAX_RETRIES": 10,
+}
+
+_deferred_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_pending: dict[Hashable, tuple[str, dict]] = {}
+_flushing: dict[Hashable, tuple[str, dict]] = {}
+_flusher = None
+_flush_wakeup = threading.Event()
+_flush_stop = threading.Event()
+
+_deferred_stats = {
+    "deferred": 0,
+    "merged": 0,
+    "flushes": 0,
+    "flushed": 0,
+    "failures": 0,
+    "dropped": 0,
+}
+
+# Background maintenance
+MAINTENANCE = {
+    "ENABLED": False,
+    "INTERVAL": 3600,
+    "SESSION_TTL": 30 * 24 * 3600,
+    "DELETE_BATCH": 1000,
+    "VACUUM_PAGES": 1000,
+    "CHECKPOINT": "TRUNCATE",
+}
+
+_maintenance_tasks: list[tuple[str, Callable[[], int]]] = []
+_maintainer = None
+_maintenance_stop = threading.Event()
+_maintenance_report = {}
+
+# Per statement instrumentation
+PROFILING = {
+    "ENABLED": False,
+    "SLOW_QUERY_MS": 50,
+    "MAX_STATEMENTS": 200,
+}
+
+_profile_lock = threading.Lock()
+_profile: dict[str, dict] = {}
+
+
+class _TimedCursor:
+    """Cursor recording the latency of its statements in the query stats"""
+
+    def __init__(self, cur: sqlite3.Cursor) -> None:
+        self._cur = cur
+
+    def execute(self, sql: str, format=()):
+        start = time.perf_counter()
+        self._cur.execute(sql, format)
+        _record(sql, format or None, time.perf_counter() -
+                start, max(self._cur.rowcount, 0))
+
+        return self
+
+    def executemany(self, sql: str, formats):
+        formats = list(formats)
+
+        start = time.perf_counter()
+        self._cur.executemany(sql, formats)
+        _record(sql, formats[0] if formats else None,
+                time.perf_counter() - start, max(self._cur.rowcount, 0))
+
+        return self
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+class _Lease:
+    """Connection held by a thread, returned to the pool when the thread exits"""
+
+    def __init__(self, conn: sqlite3.Connection, generation: int) -> None:
+        self.conn = conn
+        self.generation = generation
+
+    def __del__(self):
+        try:
+            _release(self.conn, self.generation)
+        except Exception:
+            pass  # Interpreter shutting down
 
 
 def setup(config_path: str) -> None:
@@ -38,51 +176,153 @@ def setup(config_path: str) -> None:
     """
 
     with open(config_path) as f:
-        path = json.load(f)["database"]["DB_PATH"]
+        config = json.load(f)["database"]
+
+    connect(
+        config["DB_PATH"],
+        pragmas=config.get("PRAGMAS"),
+        pool_size=config.get("POOL_SIZE", 8),
+        busy_timeout=config.get("BUSY_TIMEOUT", 5000)
+    )
 
-    connect(path)
+    WRITE_BEHIND.update(config.get("WRITE_BEHIND", {}))
 
+    if WRITE_BEHIND["ENABLED"]:
+        start_write_behind()
 
-def connect(db_path: str) -> None:
+    PROFILING.update(config.get("PROFILING", {}))
+    MAINTENANCE.update(config.get("MAINTENANCE", {}))
+
+    if MAINTENANCE["ENABLED"]:
+        start_maintenance()
+
+
+def connect(db_path: str, pragmas: dict = None, pool_size: int = 8, busy_timeout: int = 5000) -> None:
     """
     Connect to database
 
     Args:
         db_path: path to database
+        pragmas (optional): PRAGMA name:value set on every connection,
+            merged into DEFAULT_PRAGMAS (synchronous, cache_size, mmap_size)
+        pool_size (optional): max idle connections kept open
+        busy_timeout (optional): ms to wait for a lock held by another connection
 
     Returns:
         None
 
     Raises:
-        sqlite3.OperationalError: Database cannot be opened
+        sqlite3.OperationalError: Database cannot be opened or created
         sqlite3.OperationalError: Database is already connected
     """
-    global _connection
+    global _db_path
+    global _pragmas
+    global _pool_size
+    global _busy_timeout
 
-    if _connection is not None:
+    if _db_path is not None:
         raise sqlite3.OperationalError(
             "Database is already connected, run disconnect() before connecting")
 
-    _connection = sqlite3.connect(f'file:{str(db_path)}?mode=rw', uri=True)
+    _db_path = db_path
+    _pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+    _pool_size = pool_size
+    _busy_timeout = busy_timeout
+
+    try:
+        conn = _open_connection()
+
+        # Persistent setting of the database file
+        conn.execute("PRAGMA journal_mode=WAL")
+        _release(conn, _generation)
+
+    except sqlite3.Error:
+        _db_path = None
+        raise
+
+
+def _open_connection() -> sqlite3.Connection:
+
+    conn = sqlite3.connect(
+        f'file:{str(_db_path)}?mode=rwc',
+        uri=True,
+        timeout=_busy_timeout / 1000,
+        check_same_thread=False  # Closed by other threads on release
+    )
+
+    conn.execute(f"PRAGMA busy_timeout={int(_busy_timeout)}")
+
+    for name, value in _pragmas.items():
+        conn.execute(f"PRAGMA {name}={value}")
+
+    with _lock:
+        _open.add(conn)
+
+    return conn
+
+
+def _release(conn: sqlite3.Connection, generation: int) -> None:
+    """Return a connection to the pool, close it if the pool is full"""
+
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+
+    except sqlite3.Error:
+        pass
+
+    with _lock:
+        if generation == _generation and conn in _open and len(_idle) < _pool_size:
+            _idle.append(conn)
+            return
+
+        _open.discard(conn)
+
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
 
 
 @atexit.register
 def disconnect() -> None:
-    """Disconnect from database"""
-    global _connection
+    """Disconnect from database, flushing deferred writes and closing all connections"""
+    global _db_path
+    global _generation
 
-    if _connection is None:
+    if _db_path is None:
         return
 
-    conn = get_connection()
-    conn.commit()
-    conn.close()
-    _connection = None
+    stop_maintenance()
+
+    try:
+        stop_write_behind()
+
+    except sqlite3.Error:
+        _drop_pending("on disconnect")
+
+    with _lock:
+        if _db_path is None:
+            return
+
+        connections = list(_open)
+
+        _open.clear()
+        _idle.clear()
+        _generation += 1
+        _db_path = None
+
+    for conn in connections:
+        try:
+            conn.commit()
+            conn.close()
+        except sqlite3.Error:
+            pass
 
 
 def get_connection() -> sqlite3.Connection:
     """
-    Get connection object of database
+    Get connection object of database leased to the calling thread
 
     Returns: 
         sqlite3.Connection
@@ -91,12 +331,25 @@ def get_connection() -> sqlite3.Connection:
         sqlite3.OperationalError: Database not connected
 
     """
-    global _connection
-    if not _connection:
+
+    if _db_path is None:
         raise sqlite3.OperationalError(
             "Database is Not Connected: Run db.connect() first")
 
-    return _connection
+    lease = getattr(_local, "lease", None)
+
+    if lease is not None and lease.generation == _generation:
+        return lease.conn
+
+    with _lock:
+        conn = _idle.pop() if _idle else None
+        generation = _generation
+
+    if conn is None:
+        conn = _open_connection()
+
+    _local.lease = _Lease(conn, generation)
+    return conn
 
 
 def get_cursor():
@@ -110,13 +363,23 @@ def get_cursor():
         sqlite3.OperationalError: Database not connected
     """
 
-    global _connection
+    return get_connection().cursor()
 
-    if not _connection:
-        raise sqlite3.OperationalError(
-            "Database is Not Connected: Run db.connect() first")
 
-    return _connection.cursor()
+def stats() -> dict:
+    """
+    Get counters of the connection pool
+
+    Returns:
+        dict of open and idle connections
+    """
+
+    with _lock:
+        return {
+            "open_connections": len(_open),
+            "idle_connections": len(_idle),
+            "pool_size": _pool_size,
+        }
 
 
 def execute(sql: str, format=None) -> list[tuple]:
@@ -137,12 +400,127 @@ def execute(sql: str, format=None) -> list[tuple]:
     """
     cur = get_cursor()
 
+    if not PROFILING["ENABLED"]:
+        return _fetch(cur, sql, format)
+
+    start = time.perf_counter()
+    rows = _fetch(cur, sql, format)
+    _record(sql, format, time.perf_counter() - start, len(rows))
+
+    return rows
+
+
+def _fetch(cur: sqlite3.Cursor, sql: str, format) -> list[tuple]:
+
     if format is not None:
         return cur.execute(sql, format).fetchall()
     else:
         return cur.execute(sql).fetchall()
 
 
+@lru_cache(maxsize=1024)
+def normalize_sql(sql: str) -> str:
+    """
+    Get the key of a statement in the query stats
+
+    Literals are replaced by ?, lists of placeholders are collapsed and
+    whitespace is removed, so statements differing only by values share a key.
+
+    Args:
+        sql: SQL
+
+    Returns:
+        normalized SQL
+    """
+
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r":\w+|\?\d*", "?", sql)
+    sql = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(...)", sql)
+
+    return " ".join(sql.split())
+
+
+def _record(sql: str, format, elapsed: float, rows: int) -> None:
+    """Add a statement to the query stats, log it if slow"""
+
+    key = normalize_sql(sql)
+    slow = elapsed * 1000 >= PROFILING["SLOW_QUERY_MS"]
+
+    with _profile_lock:
+        entry = _profile.get(key)
+
+        if entry is None:
+            if len(_profile) >= PROFILING["MAX_STATEMENTS"]:
+                key = "(other)"
+
+            entry = _profile.setdefault(key, {
+                "count": 0,
+                "total_time": 0.0,
+                "max_time": 0.0,
+                "rows": 0,
+                "slow": 0,
+            })
+
+        entry["count"] += 1
+        entry["total_time"] += elapsed
+        entry["max_time"] = max(entry["max_time"], elapsed)
+        entry["rows"] += rows
+        entry["slow"] += slow
+
+    if slow:
+        slow_logger.warning("Slow query (%.1f ms, %d rows): %s\nQuery plan:\n%s",
+                            elapsed * 1000, rows, key, _query_plan(sql, format))
+
+
+def _query_plan(sql: str, format) -> str:
+
+    try:
+        plan = _fetch(get_cursor(), "EXPLAIN QUERY PLAN " + sql, format)
+        return "\n".join(f"  {row[-1]}" for row in plan)
+
+    except sqlite3.Error as e:
+        return f"  unavailable: {e}"
+
+
+def query_stats(limit: int = 20) -> list[dict]:
+    """
+    Get the statements that took the most time
+
+    Args:
+        limit (optional): max number of statements
+
+    Returns:
+        list of dict of sql, count, total/avg/max time in ms, rows and
+        slow count, ordered by total time
+    """
+
+    with _profile_lock:
+        entries = [(sql, dict(entry)) for sql, entry in _profile.items()]
+
+    entries.sort(key=lambda item: item[1]["total_time"], reverse=True)
+
+    return [
+        {
+            "sql": sql,
+            "count": entry["count"],
+            "total_ms": round(entry["total_time"] * 1000, 3),
+            "avg_ms": round(entry["total_time"] * 1000 / entry["count"], 3),
+            "max_ms": round(entry["max_time"] * 1000, 3),
+            "rows": entry["rows"],
+            "slow": entry["slow"],
+        }
+        for sql, entry in entries[:limit]
+    ]
+
+
+def reset_query_stats() -> None:
+    """Clear the recorded query stats"""
+
+    with _profile_lock:
+        _profile.clear()
+
+
 def commit() -> None:
     """
     Commit changes to database
@@ -154,6 +532,58 @@ def commit() -> None:
     get_connection().commit()
 
 
+@contextmanager
+def transaction(immediate: bool = False):
+    """
+    Run several statements in one transaction
+
+        with db.transaction() as cur:
+            cur.execute(...)
+            cur.executemany(...)
+
+    Commits when the block exits, rolls back if it raises. With PROFILING
+    enabled the statements and the commit are recorded in the query stats.
+
+    Args:
+        immediate (optional): take the write lock when the transaction
+            starts, for blocks that read then write rows
+
+    Yields:
+        sqlite3.Cursor objects
+
+    Raises:
+        sqlite3.OperationalError: Database not connected
+    """
+
+    conn = get_connection()
+    cur = conn.cursor()
+
+    if immediate:
+        cur.execute("BEGIN IMMEDIATE")
+
+    if not PROFILING["ENABLED"]:
+        try:
+            yield cur
+            conn.commit()
+
+        except BaseException:
+            conn.rollback()
+            raise
+
+        return
+
+    try:
+        yield _TimedCursor(cur)
+
+        start = time.perf_counter()
+        conn.commit()
+        _record("COMMIT", None, time.perf_counter() - start, 0)
+
+    except BaseException:
+        conn.rollback()
+        raise
+
+
 def execute_and_commit(sql: str, format=None) -> list[tuple]:
     """
     Execute and commit SQL command to database
@@ -172,10 +602,379 @@ def execute_and_commit(sql: str, format=None) -> list[tuple]:
     """
 
     cur = get_cursor()
-    if format is not None:
-        cur = cur.execute(sql, format).fetchall()
-    else:
-        cur = cur.execute(sql).fetchall()
 
+    if not PROFILING["ENABLED"]:
+        rows = _fetch(cur, sql, format)
+        commit()
+        return rows
+
+    start = time.perf_counter()
+    rows = _fetch(cur, sql, format)
     commit()
-    return cur
+    _record(sql, format, time.perf_counter() - start, len(rows))
+
+    return rows
+
+
+def start_write_behind() -> None:
+    """Start the background flusher of deferred writes"""
+    global _flusher
+
+    if _flusher is not None:
+        return
+
+    _flush_stop.clear()
+    _flusher = threading.Thread(
+        target=_run_flusher, name="db-flusher", daemon=True)
+    _flusher.start()
+
+
+def stop_write_behind() -> None:
+    """Stop the background flusher and commit all deferred writes"""
+    global _flusher
+
+    if _flusher is not None:
+        _flush_stop.set()
+        _flush_wakeup.set()
+        _flusher.join()
+        _flusher = None
+
+    flush()
+
+
+def _run_flusher() -> None:
+
+    failures = 0
+
+    while not _flush_stop.is_set():
+        if failures:
+            # Back off, ignoring full batches, until the database recovers
+            _flush_stop.wait(min(
+                WRITE_BEHIND["INTERVAL"] * 2 ** failures, WRITE_BEHIND["MAX_BACKOFF"]))
+        else:
+            _flush_wakeup.wait(WRITE_BEHIND["INTERVAL"])
+
+        _flush_wakeup.clear()
+
+        try:
+            flush()
+            failures = 0
+
+        except Exception as e:
+            failures += 1
+
+            with _deferred_lock:
+                _deferred_stats["failures"] += 1
+
+            if failures == 1:
+                logger.exception("Failed to flush deferred writes")
+            else:
+                logger.warning(
+                    "Failed to flush deferred writes (%s in a row): %s", failures, e)
+
+            if failures >= WRITE_BEHIND["MAX_RETRIES"]:
+                _drop_pending(f"after {failures} failed flushes")
+                failures = 0
+
+
+def _drop_pending(reason: str) -> int:
+    """Drop the deferred writes that could not be committed"""
+    global _pending
+
+    with _deferred_lock:
+        dropped, _pending = _pending, {}
+        _deferred_stats["dropped"] += len(dropped)
+
+    statements = sorted({normalize_sql(sql) for sql, _ in dropped.values()})
+    logger.error("Dropped %s deferred writes %s: %s",
+                 len(dropped), reason, statements)
+
+    return len(dropped)
+
+
+def execute_deferred(key: Hashable, sql: str, format: dict) -> None:
+    """
+    Execute a SQL command later, together with other deferred commands
+
+    A pending command with the same key is replaced, so the command should
+    write the whole state of the key (e.g. an upsert). Executed immediately
+    if write-behind is not running.
+
+    Args:
+        key: identity of the row written, e.g. ("table", id)
+        sql: SQL
+        format: dict as used in sqlite3.Cursor.execute(sql,format)
+
+    Returns:
+        None
+
+    Raises:
+        sqlite3.OperationalError: Database not connected
+        sqlite3.OperationalError: Invaild SQL syntax (write-behind disabled)
+    """
+
+    if _flusher is None:
+        execute_and_commit(sql, format)
+        return
+
+    with _deferred_lock:
+        if key in _pending:
+            _deferred_stats["merged"] += 1
+
+        _pending[key] = (sql, format)
+        _deferred_stats["deferred"] += 1
+
+        full = len(_pending) >= WRITE_BEHIND["BATCH_SIZE"]
+
+    if full:
+        _flush_wakeup.set()
+
+
+def get_deferred(key: Hashable) -> Optional[dict]:
+    """
+    Get the parameters of a deferred write not yet committed
+
+    Args:
+        key: key given to execute_deferred()
+
+    Returns:
+        format dict of the latest write of the key, None if there is none
+    """
+
+    with _deferred_lock:
+        pending = _pending.get(key) or _flushing.get(key)
+
+    return pending[1] if pending is not None else None
+
+
+def flush() -> int:
+    """
+    Commit all deferred writes in one transaction
+
+    Returns:
+        number of writes committed
+
+    Raises:
+        sqlite3.Error: Database error, the writes are kept pending
+    """
+    global _pending
+    global _flushing
+
+    with _flush_lock:
+        with _deferred_lock:
+            if not _pending:
+                return 0
+
+            # Stay visible to get_deferred() until committed
+            _flushing, _pending = _pending, {}
+
+        try:
+            with transaction() as cur:
+                for sql, format in _flushing.values():
+                    cur.execute(sql, format)
+
+        except BaseException:
+            with _deferred_lock:
+                # Newer writes of a key win over the failed ones
+                _flushing.update(_pending)
+                _pending, _flushing = _flushing, {}
+            raise
+
+        with _deferred_lock:
+            count = len(_flushing)
+            _flushing = {}
+
+            _deferred_stats["flushes"] += 1
+            _deferred_stats["flushed"] += count
+
+        return count
+
+
+def write_behind_stats() -> dict:
+    """
+    Get counters of the deferred writes
+
+    Returns:
+        dict of deferred, merged, flushed and dropped writes and failed flushes
+    """
+
+    with _deferred_lock:
+        result = dict(_deferred_stats)
+        result["pending"] = len(_pending)
+
+    return result
+
+
+def register_maintenance(name: str, task: Callable[[], int]) -> None:
+    """
+    Run a cleanup task on every maintenance run
+
+    Args:
+        name: name of the task in the report
+        task: function returning the number of rows removed
+    """
+
+    _maintenance_tasks.append((name, task))
+
+
+def start_maintenance() -> None:
+    """Start the background maintenance task"""
+    global _maintainer
+
+    if _maintainer is not None:
+        return
+
+    _maintenance_stop.clear()
+    _maintainer = threading.Thread(
+        target=_run_maintenance, name="db-maintenance", daemon=True)
+    _maintainer.start()
+
+
+def stop_maintenance() -> None:
+    """Stop the background maintenance task"""
+    global _maintainer
+
+    if _maintainer is None:
+        return
+
+    _maintenance_stop.set()
+    _maintainer.join()
+    _maintainer = None
+
+
+def _run_maintenance() -> None:
+
+    while not _maintenance_stop.wait(MAINTENANCE["INTERVAL"]):
+        try:
+            report = maintain()
+            logger.info("Database maintenance: %s", report)
+
+        except Exception:
+            logger.exception("Database maintenance failed")
+
+
+def expire_sessions(max_age: float) -> int:
+    """
+    Delete session state of chats not seen for max_age seconds
+
+    Rows are deleted in batches of MAINTENANCE["DELETE_BATCH"] so that
+    writers are not blocked for long.
+
+    Args:
+        max_age: seconds since the row was last updated
+
+    Returns:
+        number of rows deleted
+
+    Raises:
+        sqlite3.Error: Database error
+    """
+
+    cutoff = time.time() - max_age
+    deleted = 0
+
+    while True:
+        rows = execute_and_commit(
+            """
+            DELETE FROM usercommandstate WHERE rowid IN (
+                SELECT rowid FROM usercommandstate WHERE updated_at < ? LIMIT ?
+            )
+            RETURNING 1
+            """,
+            (cutoff, MAINTENANCE["DELETE_BATCH"])
+        )
+
+        deleted += len(rows)
+
+        if len(rows) < MAINTENANCE["DELETE_BATCH"]:
+            return deleted
+
+
+def table_sizes() -> dict:
+    """
+    Get the number of rows and, if available, bytes used by each table
+
+    Returns:
+        dict of table name: {"rows": int, "bytes": int or None}
+    """
+
+    tables = [name for (name,) in execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+
+    try:
+        used = dict(execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"))
+    except sqlite3.OperationalError:
+        used = {}  # dbstat is not compiled in
+
+    return {
+        name: {
+            "rows": execute(f'SELECT COUNT(*) FROM "{name}"')[0][0],
+            "bytes": used.get(name)
+        }
+        for name in tables
+    }
+
+
+def maintain() -> dict:
+    """
+    Run one maintenance pass
+
+    Expires session rows older than SESSION_TTL, runs the registered tasks,
+    frees up to VACUUM_PAGES unused pages and checkpoints the WAL.
+    Pages are only freed once the file has been converted with
+    schema.enable_incremental_vacuum().
+
+    Returns:
+        report of rows deleted, pages reclaimed, checkpoint and table sizes
+
+    Raises:
+        sqlite3.Error: Database error
+    """
+
+    start = time.perf_counter()
+    deleted = {"usercommandstate": expire_sessions(MAINTENANCE["SESSION_TTL"])}
+
+    for name, task in list(_maintenance_tasks):
+        try:
+            deleted[name] = task()
+        except sqlite3.Error:
+            logger.exception("Maintenance task %s failed", name)
+
+    free_pages = execute("PRAGMA freelist_count")[0][0]
+    # execute() steps once, freeing a single page
+    get_connection().executescript(
+        f"PRAGMA incremental_vacuum({int(MAINTENANCE['VACUUM_PAGES'])})")
+    reclaimed = free_pages - execute("PRAGMA freelist_count")[0][0]
+
+    busy, wal_pages, checkpointed = execute(
+        f"PRAGMA wal_checkpoint({MAINTENANCE['CHECKPOINT']})")[0]
+
+    report = {
+        "time": time.time(),
+        "duration": round(time.perf_counter() - start, 3),
+        "deleted": deleted,
+        "reclaimed_pages": reclaimed,
+        "free_pages": free_pages - reclaimed,
+        "page_count": execute("PRAGMA page_count")[0][0],
+        "page_size": execute("PRAGMA page_size")[0][0],
+        "checkpoint": {"busy": busy, "wal_pages": wal_pages, "checkpointed": checkpointed},
+        "tables": table_sizes(),
+    }
+
+    with _lock:
+        _maintenance_report.clear()
+        _maintenance_report.update(report)
+
+    return report
+
+
+def maintenance_stats() -> dict:
+    """
+    Get the report of the last maintenance pass
+
+    Returns:
+        dict of the last report, empty if maintenance has not run yet
+    """
+
+    with _lock:
+        return dict(_maintenance_report)
@@ -0,0 +1,319 @@
+"""
+Durable outbox of messages waiting to be sent to telegram.
+
+Actions returned by modules are written to the outbox table of the database
+and sent by a background sender. The sender drains the table in batches,
+sending only the oldest pending message of each chat at a time so that the
+messages of a chat keep their order. Messages without a chat are sent
+independently of each other. Failed messages are retried with
+backoff and moved to the dead letters after MAX_ATTEMPTS.
+
+    Typical usage example:
+
+    import core.outbox as outbox
+
+    outbox.setup("config.json")
+    outbox.start()
+    outbox.enqueue(SendMessage(chat_id, "hello"))
+
+"""
+import json
+import time
+import atexit
+import logging
+import threading
+import requests
+
+from core import client
+from core import database as db
+from utils.api.methods import TelegramMethods
+from utils.server.workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+CONFIG = {
+    "ENABLED": False,
+    "BATCH_SIZE": 20,
+    "SENDERS": 4,
+    "MAX_ATTEMPTS": 5,
+    "RETRY_BACKOFF": 2,
+    "POLL_INTERVAL": 1,
+}
+
+_token = None
+_thread = None
+_senders: WorkerPool = None
+_wakeup = threading.Event()
+_stop = threading.Event()
+_lock = threading.Lock()
+
+_stats = {
+    "enqueued": 0,
+    "sent": 0,
+    "retried": 0,
+    "dead": 0,
+    "batches": 0,
+}
+
+
+def setup(config_path: str) -> None:
+    """
+    Configure the outbox using a config file
+
+    Args:
+        config_path: path to a JSON config file
+
+    Returns:
+        None
+
+    Raises:
+        IOError: Config file cannot be read
+        json.JSONDecodeError: Invaild JSON
+        KeyError: The keys: ["server"]["BOT_TOKEN"] does not exist
+    """
+    global _token
+
+    with open(config_path) as f:
+        config = json.load(f)
+
+    CONFIG.update(config.get("outbox", {}))
+    _token = config["server"]["BOT_TOKEN"]
+
+
+def is_enabled() -> bool:
+    """Messages are sent through the outbox"""
+    return CONFIG["ENABLED"] and _thread is not None
+
+
+def enqueue(action: TelegramMethods) -> int:
+    """
+    Store an action to be sent by the background sender
+
+    Args:
+        action: TelegramMethods object
+
+    Returns:
+        id of the outbox row
+
+    Raises:
+        ValueError: The action uploads more than one file
+        sqlite3.Error: Database error
+    """
+
+    params, files = action.request_parts()
+    params = {k: v for k, v in params.items() if v is not None}
+
+    file_field, file_data = None, None
+
+    if files:
+        if len(files) > 1:
+            raise ValueError("Outbox only supports one file per message")
+
+        file_field, file_data = next(iter(files.items()))
+
+    chat_id = params.get("chat_id")
+
+    row = db.execute_and_commit(
+        """
+        INSERT INTO outbox (chat_id, method, params, file_field, file_data, created)
+        VALUES (:chat_id, :method, :params, :file_field, :file_data, :created)
+        RETURNING id
+        """,
+        {
+            "chat_id": str(chat_id) if chat_id is not None else None,
+            "method": action.method,
+            "params": json.dumps(params),
+            "file_field": file_field,
+            "file_data": file_data,
+            "created": time.time()
+        }
+    )
+
+    with _lock:
+        _stats["enqueued"] += 1
+
+    _wakeup.set()
+    return row[0][0]
+
+
+def _fetch_batch() -> list[tuple]:
+    """Oldest pending message of each chat that is due, and messages without a chat"""
+
+    return db.execute(
+        """
+        SELECT id, method, params, file_field, file_data, attempts FROM outbox
+        WHERE id IN (
+            SELECT MIN(id) FROM outbox WHERE status = 'pending'
+            GROUP BY COALESCE(chat_id, '#' || id)
+        )
+        AND next_attempt <= :now
+        ORDER BY id
+        LIMIT :limit
+        """,
+        {"now": time.time(), "limit": CONFIG["BATCH_SIZE"]}
+    )
+
+
+def _send(row: tuple):
+    """Post a message, returns (id, attempts, status code, response or error)"""
+
+    id, method, params, file_field, file_data, attempts = row
+    files = {file_field: file_data} if file_field is not None else None
+
+    try:
+        r = client.post(_token, method, params=json.loads(params), files=files)
+        return id, attempts, r.status_code, r.text
+
+    except requests.RequestException as e:
+        return id, attempts, None, str(e)
+
+
+def _complete(results: list[tuple]) -> None:
+    """Delete sent messages, schedule retries and dead letters"""
+
+    now = time.time()
+    sent, retry, dead = [], [], []
+
+    for id, attempts, status, error in results:
+        attempts += 1
+
+        if status is not None and status < 300:
+            sent.append({"id": id})
+
+        # Bad requests, blocked by user, etc. will never succeed
+        elif (status is not None and 400 <= status < 500 and status != 429) or attempts >= CONFIG["MAX_ATTEMPTS"]:
+            dead.append({"id": id, "attempts": attempts, "error": error})
+
+        else:
+            retry.append({
+                "id": id,
+                "attempts": attempts,
+                "error": error,
+                "next_attempt": now + CONFIG["RETRY_BACKOFF"] * 2 ** (attempts - 1)
+            })
+
+    with db.transaction() as cur:
+        cur.executemany("DELETE FROM outbox WHERE id = :id", sent)
+        cur.executemany(
+            "UPDATE outbox SET status = 'dead', attempts = :attempts, last_error = :error WHERE id = :id", dead)
+        cur.executemany(
+            "UPDATE outbox SET attempts = :attempts, last_error = :error, next_attempt = :next_attempt WHERE id = :id", retry)
+
+    for row in dead:
+        logger.warning("Outbox message %s dead lettered: %s",
+                       row["id"], row["error"])
+
+    with _lock:
+        _stats["sent"] += len(sent)
+        _stats["retried"] += len(retry)
+        _stats["dead"] += len(dead)
+        _stats["batches"] += 1
+
+
+def drain() -> int:
+    """
+    Send one batch of due messages
+
+    Returns:
+        number of messages in the batch
+    """
+
+    batch = _fetch_batch()
+
+    if not batch:
+        return 0
+
+    futures, results = [], []
+
+    for row in batch:
+        try:
+            futures.append((row, _senders.submit(_send, row, block=True)))
+        except Exception as e:
+            results.append(_failed(row, e))
+
+    for row, future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(_failed(row, e))
+
+    # Results already sent are recorded even if some sends failed
+    _complete(results)
+
+    return len(batch)
+
+
+def _failed(row: tuple, error: Exception) -> tuple:
+    """Result of a message that could not be sent, retried like a connection error"""
+
+    error = f"{type(error).__name__}: {error}"
+    logger.warning("Outbox message %s failed: %s", row[0], error)
+
+    return row[0], row[5], None, error
+
+
+def _run() -> None:
+
+    while not _stop.is_set():
+        _wakeup.clear()
+
+        try:
+            count = drain()
+
+        except Exception:
+            logger.exception("Outbox sender failed")
+            count = 0
+
+        # Keep going while there is a backlog
+        if count < CONFIG["BATCH_SIZE"]:
+            _wakeup.wait(CONFIG["POLL_INTERVAL"])
+
+
+def start() -> None:
+    """Start the background sender"""
+    global _thread
+    global _senders
+
+    if _thread is not None:
+        return
+
+    _senders = WorkerPool(
+        CONFIG["SENDERS"], max_queue=CONFIG["BATCH_SIZE"], name="outbox-sender")
+
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="outbox", daemon=True)
+    _thread.start()
+
+
+@atexit.register
+def stop() -> None:
+    """Stop the background sender, pending messages are kept in the table"""
+    global _thread
+
+    if _thread is None:
+        return
+
+    _stop.set()
+    _wakeup.set()
+    _thread.join()
+    _thread = None
+
+
+def stats() -> dict:
+    """
+    Get counters of the outbox
+
+    Returns:
+        dict of message counters and pending / dead messages in the table
+    """
+
+    with _lock:
+        result = dict(_stats)
+
+    counts = dict(db.execute(
+        "SELECT status, COUNT(*) FROM outbox GROUP BY status"))
+
+    result["pending"] = counts.get("pending", 0)
+    result["dead_letters"] = counts.get("dead", 0)
+
+    return result
@@ -0,0 +1,264 @@
+"""
+Versioned migrations of the database schema.
+
+Each migration upgrades the schema by one version. The version of the
+database file is kept in PRAGMA user_version, migrate() runs the
+migrations newer than it in order, each one in its own transaction
+together with the version bump. Migrations are written so that they also
+apply to databases created before versioning (version 0).
+
+    Typical usage example:
+
+    import core.database as db
+    import core.schema as schema
+
+    db.connect("example.db")
+    schema.migrate()
+    schema.enable_incremental_vacuum()  # Before serving, rebuilds the file once
+
+"""
+import time
+import logging
+import sqlite3
+
+from typing import Callable
+
+from core import database as db
+
+logger = logging.getLogger(__name__)
+
+
+def _columns(cur: sqlite3.Cursor, table: str) -> list[str]:
+    return [row[1] for row in cur.execute(f'PRAGMA table_info("{table}")')]
+
+
+def _has_unique_index(cur: sqlite3.Cursor, table: str, columns: list[str]) -> bool:
+    """Table has a unique index (or primary key) on exactly the columns"""
+
+    for _, name, unique, *_ in cur.execute(f'PRAGMA index_list("{table}")').fetchall():
+        if unique and [row[2] for row in cur.execute(f'PRAGMA index_info("{name}")')] == columns:
+            return True
+
+    return False
+
+
+def _v1_base_tables(cur: sqlite3.Cursor) -> None:
+    """Session state, as in the original users.db"""
+
+    # The legacy shortcuts table is only kept on files that have it, so that
+    # modules.shortcuts does not look for blobs to migrate on new files
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS usercommandstate (
+            user_id INT,
+            chat_id INT,
+            last_command TEXT,
+            require_follow_up BOOL,
+            PRIMARY KEY (user_id, chat_id)
+        )
+        """
+    )
+
+    # The session upsert uses ON CONFLICT(user_id, chat_id)
+    if not _has_unique_index(cur, "usercommandstate", ["user_id", "chat_id"]):
+        cur.execute(
+            """
+            DELETE FROM usercommandstate WHERE rowid NOT IN (
+                SELECT MAX(rowid) FROM usercommandstate GROUP BY user_id, chat_id
+            )
+            """
+        )
+        cur.execute(
+            "CREATE UNIQUE INDEX usercommandstate_chat ON usercommandstate (user_id, chat_id)")
+
+
+def _v2_session_updated_at(cur: sqlite3.Cursor) -> None:
+    """Last update of a session, used to expire stale sessions"""
+
+    if "updated_at" not in _columns(cur, "usercommandstate"):
+        cur.execute(
+            "ALTER TABLE usercommandstate ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+        cur.execute("UPDATE usercommandstate SET updated_at = ?", (time.time(),))
+
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS usercommandstate_updated ON usercommandstate (updated_at)")
+
+
+def _v3_shortcut(cur: sqlite3.Cursor) -> None:
+    """One row per shortcut, replacing the command_list blobs"""
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS shortcut (
+            user_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            command TEXT NOT NULL,
+            PRIMARY KEY (user_id, position)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS shortcut_name ON shortcut (user_id, name COLLATE NOCASE)")
+
+
+def _v4_outbox(cur: sqlite3.Cursor) -> None:
+    """Messages waiting to be sent, see core.outbox"""
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT,
+            method TEXT NOT NULL,
+            params TEXT NOT NULL,
+            file_field TEXT,
+            file_data BLOB,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL DEFAULT 0,
+            created REAL NOT NULL,
+            last_error TEXT
+        )
+        """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS outbox_status_chat ON outbox (status, chat_id, id)")
+
+
+def _v5_processed_update(cur: sqlite3.Cursor) -> None:
+    """Recently received update ids, see utils.server.dedup"""
+
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS processed_update (update_id INTEGER PRIMARY KEY)")
+
+
+def _v6_callback_token(cur: sqlite3.Cursor) -> None:
+    """Tokens of long callback data, see core.callbacks"""
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS callback_token (
+            token TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires REAL NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _v7_outbox_null_chat(cur: sqlite3.Cursor) -> None:
+    """Outbox messages without a chat, stored as "None" before, have a NULL chat_id"""
+
+    cur.execute("UPDATE outbox SET chat_id = NULL WHERE chat_id = 'None'")
+
+
+# MIGRATIONS[i] upgrades the schema from version i to i + 1
+MIGRATIONS: list[Callable[[sqlite3.Cursor], None]] = [
+    _v1_base_tables,
+    _v2_session_updated_at,
+    _v3_shortcut,
+    _v4_outbox,
+    _v5_processed_update,
+    _v6_callback_token,
+    _v7_outbox_null_chat,
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def get_version() -> int:
+    """
+    Get the schema version of the database
+
+    Raises:
+        sqlite3.OperationalError: Database not connected
+    """
+
+    return db.execute("PRAGMA user_version")[0][0]
+
+
+def migrate() -> int:
+    """
+    Upgrade the schema of the database to LATEST_VERSION
+
+    Safe to run from several processes at once, a migration is only applied
+    by the process holding the write lock.
+
+    Returns:
+        number of migrations applied
+
+    Raises:
+        sqlite3.OperationalError: Database not connected
+        sqlite3.OperationalError: Database version is newer than this code
+        sqlite3.Error: A migration failed, the database is left at the
+            version of the last successful migration
+    """
+
+    version = get_version()
+
+    if version == LATEST_VERSION:
+        return 0
+
+    if version > LATEST_VERSION:
+        raise sqlite3.OperationalError(
+            f"Database schema version {version} is newer than supported version {LATEST_VERSION}")
+
+    conn = db.get_connection()
+    applied = 0
+
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+
+        try:
+            cur = conn.cursor()
+
+            # Another process may have migrated while waiting for the lock
+            version = cur.execute("PRAGMA user_version").fetchone()[0]
+
+            if version >= LATEST_VERSION:
+                conn.rollback()
+                return applied
+
+            migration = MIGRATIONS[version]
+            migration(cur)
+            cur.execute(f"PRAGMA user_version = {version + 1}")
+
+            conn.commit()
+
+        except BaseException:
+            conn.rollback()
+            raise
+
+        applied += 1
+        logger.info("Migrated database to version %s: %s",
+                    version + 1, migration.__doc__)
+
+
+def enable_incremental_vacuum() -> bool:
+    """
+    Switch the file to auto_vacuum=INCREMENTAL so that the maintenance task
+    can return free pages to the file system
+
+    The switch needs a full VACUUM, which rebuilds the file and blocks
+    every other connection until it is done. Run it at startup before
+    handling updates.
+
+    Returns:
+        True if the file was rebuilt, False if it already was incremental
+
+    Raises:
+        sqlite3.OperationalError: Database not connected
+        sqlite3.OperationalError: Database is locked by another connection
+    """
+
+    if db.execute("PRAGMA auto_vacuum")[0][0] == 2:
+        return False
+
+    logger.info("Rebuilding database to enable incremental vacuum")
+
+    conn = db.get_connection()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+
+    return True
@@ -2,22 +2,117 @@ import shlex
 import socketserver
 import ssl
 import json
-import requests
+import logging
+import threading
 
 from typing import Union
-from http.server import SimpleHTTPRequestHandler
-from utils.api.methods import SendMessage
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, SimpleHTTPRequestHandler, ThreadingHTTPServer
+from core import client
+from core import outbox
+from core import callbacks
+from core import database
+from utils.api.methods import TelegramMethods, SendMessage, AnswerCallbackQuery
 from utils.api.objects import *
 from utils.exceptions import NotSupportedErr
+from utils.server import session
 from utils.server.session import UserSession
+from utils.server.workers import WorkerPool, PoolFullErr
+from utils.server.dispatcher import ChatDispatcher
+from utils.server.polling import UpdatePoller
+from utils.server.reply import InlineReply, RunCommand
+from utils.server.dedup import RecentUpdates
 
 CONFIG = {}
 MODULES = {}
+WORKERS: WorkerPool = None
+DISPATCHER: ChatDispatcher = None
+POLLER: UpdatePoller = None
+CALLBACK_SENDER: WorkerPool = None
+RECENT_UPDATES: RecentUpdates = None
+
+logger = logging.getLogger(__name__)
+
+# State of the update handled by the current worker thread
+_context = threading.local()
+
+
+def send(action: TelegramMethods, raise_errors=False):
+    """
+    Send an action to telegram.
+
+    If the update being handled was received with INLINE_REPLY enabled, the
+    first action is returned in the webhook response instead of posted.
+    When the outbox is enabled, actions are queued in the outbox and sent
+    in the background.
+
+    Args:
+        action: TelegramMethods object to send
+        raise_errors (optional): raise on a HTTP error
+
+    Returns:
+        None
+
+    Raises:
+        requests.HTTPError: An error occured posting to telegram servers
+        sqlite3.Error: Failed to queue the action in the outbox
+    """
+
+    reply: InlineReply = getattr(_context, "inline_reply", None)
+
+    if reply is not None:
+        if reply.offer(action):
+            return
+
+        # Keep replies in order behind the webhook response
+        reply.wait_sent(CONFIG.get("INLINE_REPLY_TIMEOUT", 2))
+
+    if outbox.is_enabled():
+        outbox.enqueue(action)
+        return
+
+    action(CONFIG["BOT_TOKEN"], raise_errors=raise_errors)
+
+
+def answer_callback_query(answer: AnswerCallbackQuery = None):
+    """
+    Answer the callback query of the update being handled in the background.
+
+    Does nothing if the update is not a callback query or if it has already
+    been answered.
+
+    Args:
+        answer (optional): answer with text/show_alert/cache_time, defaults
+            to an empty answer
+
+    Returns:
+        None
+    """
+
+    callback_query_id = getattr(_context, "callback_query_id", None)
+
+    if callback_query_id is None:
+        return
+
+    _context.callback_query_id = None
+
+    if answer is None:
+        answer = AnswerCallbackQuery()
+
+    if answer.callback_query_id is None:
+        answer.callback_query_id = callback_query_id
+
+    try:
+        CALLBACK_SENDER.submit(answer, CONFIG["BOT_TOKEN"])
+
+    except PoolFullErr:
+        answer(CONFIG["BOT_TOKEN"])
 
 
 def run_command_from_modules(*args, **kwargs):
     """
-    Get replies from modules and send it
+    Get replies from modules and send it, RunCommand replies are handled
+    as commands of the user
 
     Args:
         *args: Commands arguments to pass to modules
@@ -38,8 +133,18 @@ def run_command_from_modules(*args, **kwargs):
     if module == None:
         raise NotSupportedErr
 
-    for action in module.get_reply(*args, **kwargs):
-        action(CONFIG["BOT_TOKEN"], raise_errors=True)
+    actions = module.get_reply(*args, **kwargs)
+
+    # Answer the pressed button while the replies are being sent
+    answers = [a for a in actions if isinstance(a, AnswerCallbackQuery)]
+    answer_callback_query(answers[0] if answers else None)
+
+    for action in actions:
+        if isinstance(action, RunCommand):
+            handle_text_data(kwargs["user_id"], kwargs["chat_id"], action.text)
+
+        elif not isinstance(action, AnswerCallbackQuery):
+            send(action, raise_errors=True)
 
     return
 
@@ -63,11 +168,14 @@ def parse_incoming_res(res_type: str, response: Union[str, dict]):
     try:
         if "callback_query" == res_type:
             cbq = CallbackQuery.decode(response)
-            cbq.answer(CONFIG["BOT_TOKEN"])
 
             chat_id = cbq.get_chat_id()
             user_id = cbq.get_user_id()
-            data = cbq.data
+            data = callbacks.resolve(cbq.data)
+
+            if data is None and cbq.data is not None:
+                answer_callback_query(AnswerCallbackQuery(
+                    text="This button has expired, please request it again"))
 
         elif "message" == res_type:
             msg = Message.decode(response)
@@ -123,67 +231,290 @@ def handle_text_data(user_id, chat_id, text):
 
     else:  # last check of text
         if text in ['hello', 'hi']:
-            SendMessage(chat_id, "Beep Boop").post(CONFIG["BOT_TOKEN"])
+            send(SendMessage(chat_id, "Beep Boop"))
 
         else:
             raise NotSupportedErr
 
 
+def get_update_chat_id(obj_type: str, received: dict):
+    """
+    Get the chat id of a raw update without decoding it.
+
+    Used to pick the dispatch lane before the update is parsed.
+
+    Args:
+        obj_type: Name of object received
+        received: dict of object
+
+    Returns:
+        chat id, user id of the sender if the chat is missing, else None
+    """
+
+    if not isinstance(received, dict):
+        return None
+
+    if "callback_query" == obj_type:
+        received = received.get("message") or received
+
+    chat = received.get("chat") or received.get("from") or {}
+    return chat.get("id")
+
+
+def handle_update(obj_type: str, received: dict, reply: InlineReply = None):
+    """
+    Parse an update and reply to the sender. Runs on a worker thread,
+    updates of the same chat are run one at a time in arrival order.
+
+    Args:
+        obj_type: Name of object received
+            -> see https://core.telegram.org/bots/api/#update
+        received: dict of object
+        reply (optional): slot for an action sent in the webhook response
+
+    Returns:
+        None
+    """
+
+    _context.inline_reply = reply
+    _context.callback_query_id = None
+
+    if "callback_query" == obj_type and isinstance(received, dict):
+        _context.callback_query_id = received.get("id")
+
+    try:
+        _handle_update(obj_type, received)
+
+    finally:
+        # Buttons not answered by a module get an empty answer
+        answer_callback_query()
+
+        _context.inline_reply = None
+
+        if reply is not None:
+            reply.close()
+
+
+def _handle_update(obj_type: str, received: dict):
+
+    user_id, chat_id, data = parse_incoming_res(obj_type, received)
+
+    try:
+        if chat_id == None:
+            if user_id == None:
+                raise Exception("Unable to Parse Chat ID")
+            else:
+                chat_id = user_id  # backup to personal chat
+
+        if type(data) == str:
+            handle_text_data(user_id, chat_id, data)
+
+        elif type(data) == None:
+            raise NotSupportedErr("No data is sent")
+
+        elif data is None and obj_type == "callback_query":
+            pass  # Expired button, answered by parse_incoming_res()
+
+        else:
+            raise NotSupportedErr("Current type is not supported")
+
+    except NotSupportedErr as e:
+        if chat_id is not None:
+            send(SendMessage(chat_id, str(e)))
+
+    except Exception as e:
+        if chat_id is not None:
+            send(SendMessage(chat_id, "Unexpected error has occured: %s" % e))
+
+
+def dispatch_update(update: dict, reply: InlineReply = None):
+    """
+    Queue an update to be handled by the workers
+
+    Updates already received (redelivered by telegram) are dropped.
+
+    Args:
+        update: dict of update as received from telegram
+            -> see https://core.telegram.org/bots/api/#update
+        reply (optional): slot for an action sent in the webhook response
+
+    Returns:
+        concurrent.futures.Future of handle_update()
+
+    Raises:
+        KeyError, IndexError: Invaild update
+        PoolFullErr: The worker queue or the lane of the chat is full
+    """
+
+    update = dict(update)
+    update_id = update.pop("update_id")
+    obj_type = list(update.keys())[0]
+
+    received = update[obj_type]
+
+    if RECENT_UPDATES is not None and not RECENT_UPDATES.add(update_id):
+        if reply is not None:
+            reply.close()
+
+        future = Future()
+        future.set_result(None)
+        return future
+
+    try:
+        future = DISPATCHER.submit(
+            get_update_chat_id(obj_type, received),
+            handle_update, obj_type, received, reply
+        )
+
+    except PoolFullErr:
+        # Accept the update again when telegram redelivers it
+        if RECENT_UPDATES is not None:
+            RECENT_UPDATES.discard(update_id)
+        raise
+
+    if RECENT_UPDATES is not None:
+        # Stored once handled, a crash before then lets the redelivery through
+        future.add_done_callback(lambda _: _mark_processed(update_id))
+
+    return future
+
+
+def _mark_processed(update_id: int):
+
+    try:
+        RECENT_UPDATES.processed(update_id)
+
+    except Exception:
+        logger.exception("Failed to store processed update %s", update_id)
+
+
+def get_stats() -> dict:
+    """Get runtime counters of the server"""
+
+    return {
+        "workers": WORKERS.stats() if WORKERS is not None else None,
+        "dispatcher": DISPATCHER.stats() if DISPATCHER is not None else None,
+        "poller": POLLER.stats() if POLLER is not None else None,
+        "client": client.stats(),
+        "outbox": outbox.stats() if outbox.is_enabled() else None,
+        "callback_sender": CALLBACK_SENDER.stats() if CALLBACK_SENDER is not None else None,
+        "recent_updates": RECENT_UPDATES.stats() if RECENT_UPDATES is not None else None,
+        "database": database.stats(),
+        "write_behind": database.write_behind_stats(),
+        "maintenance": database.maintenance_stats(),
+        "queries": database.query_stats() if database.PROFILING["ENABLED"] else None,
+        "session_cache": session.cache_stats(),
+        "callbacks": callbacks.stats(),
+        "modules": {
+            hook: m.get_stats() for hook, m in MODULES.items() if hasattr(m, "get_stats")
+        }
+    }
+
+
+class WebhookServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    TCP server running each connection on its own thread.
+
+    Telegram keeps up to MAX_CONNECTIONS persistent connections open, each
+    one is served by a thread while the updates are handled by the workers.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+
 class RequestHandler(SimpleHTTPRequestHandler):
 
+    # Persistent connections, closed after `timeout` seconds of inactivity
+    protocol_version = "HTTP/1.1"
+    timeout = 60
+
+    def setup(self):
+        super().setup()
+
+        # TLS handshake is done here so that it does not block accept()
+        if isinstance(self.request, ssl.SSLSocket):
+            self.request.do_handshake()
+
+    def _send_body(self, code: int, body: bytes = b"", message=None, content_type=None):
+        """Send a complete response with a Content-Length header"""
+
+        self.send_response(code, message)
+
+        if content_type is not None:
+            self.send_header("Content-Type", content_type)
+
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if body:
+            self.wfile.write(body)
+
     def do_POST(self):
 
         try:
             received = json.loads(
                 self.rfile.read(
                     int(self.headers['Content-Length'])))
-            update_id = received.pop("update_id")
-            obj_type = list(received.keys())[0]
 
-            received = received[obj_type]
+            reply = InlineReply() if CONFIG.get("INLINE_REPLY") else None
+            dispatch_update(received, reply)
 
-            self.send_response(200)
-            self.end_headers()
+        except PoolFullErr as e:
+            # Telegram redelivers the update later
+            self._send_body(503, message=str(e))
+            return
 
         except Exception as e:
-            self.send_response(400, str(e))
-            self.end_headers()
+            # Request body may not have been consumed
+            self.close_connection = True
+            self._send_body(400, message=str(e))
             return
 
-        user_id, chat_id, data = parse_incoming_res(obj_type, received)
+        if reply is None:
+            self._send_body(200)
+            return
 
         try:
-            if chat_id == None:
-                if user_id == None:
-                    raise Exception("Unable to Parse Chat ID")
-                else:
-                    chat_id = user_id  # backup to personal chat
+            action = reply.take(CONFIG.get("INLINE_REPLY_TIMEOUT", 2))
 
-            if type(data) == str:
-                handle_text_data(user_id, chat_id, data)
-
-            elif type(data) == None:
-                raise NotSupportedErr("No data is sent")
+            if action is None:
+                self._send_body(200)
             else:
-                raise NotSupportedErr("Current type is not supported")
+                body = json.dumps(action.webhook_dict()).encode()
+                self._send_body(200, body, content_type="application/json")
 
-        except NotSupportedErr as e:
-            if chat_id is not None:
-                SendMessage(chat_id, str(e)).post(CONFIG["BOT_TOKEN"])
+        finally:
+            reply.sent()
 
-        except Exception as e:
-            if chat_id is not None:
-                SendMessage(chat_id, "Unexpected error has occured: %s" %
-                            e).post(CONFIG["BOT_TOKEN"])
+    def do_GET(self):
+        self._send_body(200)
+
+
+class StatsHandler(BaseHTTPRequestHandler):
+    """Serves get_stats() as JSON at GET /stats"""
 
     def do_GET(self):
+
+        if self.path != "/stats":
+            self.send_error(404)
+            return
+
+        body = json.dumps(get_stats()).encode()
+
         self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
+        self.wfile.write(body)
 
 
 def setup(config_path, modules):
     """
-    Connect to database using a config file
+    Load the server config and register the bot with telegram.
+
+    In "webhook" mode (default) the webhook is set to HOSTNAME:PORT, in
+    "polling" mode the webhook is removed so that getUpdates can be used.
 
     Args:
         config_path: path to a JSON config file 
@@ -204,34 +535,148 @@ def setup(config_path, modules):
     with open(config_path) as f:
         CONFIG = json.load(f)["server"]
 
+    # Range accepted by setWebhook
+    max_connections = CONFIG.get("MAX_CONNECTIONS", 40)
+    CONFIG["MAX_CONNECTIONS"] = min(max(int(max_connections), 1), 100)
+
+    if CONFIG["MAX_CONNECTIONS"] != max_connections:
+        logger.warning("MAX_CONNECTIONS must be 1-100, using %s",
+                       CONFIG["MAX_CONNECTIONS"])
+
     MODULES = {m.hook: m for m in modules}
 
-    with open(CONFIG["CERT_PATH"]) as cert:
-        url = f'https://api.telegram.org/bot{CONFIG["BOT_TOKEN"]}/setWebhook?url={CONFIG["HOSTNAME"]}:{CONFIG["PORT"]}'
-        requests.post(url, files={'certificate': cert}).raise_for_status()
+    for m in modules:
+        if hasattr(m, "setup"):
+            m.setup(config_path)
+
+    session.configure_cache(
+        CONFIG.get("SESSION_CACHE_SIZE", 10000),
+        CONFIG.get("SESSION_CACHE_TTL", 600)
+    )
 
-    url = f'https://api.telegram.org/bot{CONFIG["BOT_TOKEN"]}/setMyCommands'
+    if CONFIG.get("MODE", "webhook") == "polling":
+        client.post(CONFIG["BOT_TOKEN"], "deleteWebhook").raise_for_status()
+
+    else:
+        with open(CONFIG["CERT_PATH"]) as cert:
+            params = {
+                "url": f'{CONFIG["HOSTNAME"]}:{CONFIG["PORT"]}',
+                "max_connections": CONFIG["MAX_CONNECTIONS"]
+            }
+            client.post(CONFIG["BOT_TOKEN"], "setWebhook", params=params, files={
+                        'certificate': cert.read()}).raise_for_status()
 
     commands_list = [{"command": m.hook.replace(
         "/", ""), "description": m.description} for m in modules]
-    requests.post(url, params={"commands": json.dumps(
+    client.post(CONFIG["BOT_TOKEN"], "setMyCommands", params={"commands": json.dumps(
         commands_list)}).raise_for_status()
 
 
-def run():
-    """Starts the server"""
+def start_stats_server() -> ThreadingHTTPServer:
+    """
+    Serve /stats on its own plain HTTP listener in a background thread.
+
+    The listener is separate from the webhook so that the counters, which
+    include SQL text and upstream timings, are not exposed on the public
+    port. It binds to STATS["HOST"] (localhost by default).
+
+    Returns:
+        The running server
+    """
+
+    config = CONFIG.get("STATS", {})
+
+    stats_server = ThreadingHTTPServer(
+        (config.get("HOST", "127.0.0.1"), config.get("PORT", 8089)), StatsHandler)
+    stats_server.daemon_threads = True
+
+    threading.Thread(
+        target=stats_server.serve_forever, name="stats-server", daemon=True).start()
+
+    logger.info("Serving stats at http://%s:%s/stats", *stats_server.server_address[:2])
+
+    return stats_server
+
+
+def run_polling():
+    """Fetch updates with getUpdates until interrupted"""
+
+    global POLLER
+
+    POLLER = UpdatePoller(
+        CONFIG["BOT_TOKEN"],
+        dispatch_update,
+        limit=CONFIG.get("POLL_LIMIT", 100),
+        timeout=CONFIG.get("POLL_TIMEOUT", 30),
+        allowed_updates=["message", "callback_query"]
+    )
+
+    try:
+        POLLER.run()
+    except KeyboardInterrupt:
+        POLLER.stop()
+
+
+def run_webhook():
+    """Serve the webhook until interrupted"""
 
     handler = RequestHandler
-    socketserver.TCPServer.allow_reuse_address = True
-    server = socketserver.TCPServer((CONFIG["HOST"], CONFIG["PORT"]), handler)
+    handler.timeout = CONFIG.get("KEEP_ALIVE_TIMEOUT", 60)
 
-    server.socket = ssl.wrap_socket(
+    server = WebhookServer((CONFIG["HOST"], CONFIG["PORT"]), handler)
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(CONFIG["CERT_PATH"], CONFIG["KEY_PATH"])
+
+    if CONFIG["CA_CERT_PATH"] is not None:
+        context.load_verify_locations(CONFIG["CA_CERT_PATH"])
+
+    server.socket = context.wrap_socket(
         server.socket,
-        ca_certs=CONFIG["CA_CERT_PATH"],
-        certfile=CONFIG["CERT_PATH"],
-        keyfile=CONFIG["KEY_PATH"],
-        server_side=True
+        server_side=True,
+        do_handshake_on_connect=False
     )
 
-    # TODO Add threading
     server.serve_forever()
+
+
+def run():
+    """Starts the server"""
+
+    global WORKERS
+    global DISPATCHER
+    global CALLBACK_SENDER
+    global RECENT_UPDATES
+
+    polling = CONFIG.get("MODE", "webhook") == "polling"
+
+    if CONFIG.get("DEDUP_SIZE", 10000) > 0:
+        RECENT_UPDATES = RecentUpdates(
+            CONFIG.get("DEDUP_SIZE", 10000),
+            # The getUpdates offset already drops handled updates across restarts
+            persist=CONFIG.get("DEDUP_PERSIST", True) and not polling
+        )
+
+    CALLBACK_SENDER = WorkerPool(
+        CONFIG.get("CALLBACK_SENDERS", 2),
+        max_queue=CONFIG.get("WORKER_QUEUE_SIZE", 64),
+        name="callback-sender"
+    )
+    WORKERS = WorkerPool(
+        CONFIG.get("WORKERS", 8),
+        max_queue=CONFIG.get("WORKER_QUEUE_SIZE", 64),
+        name="update-worker"
+    )
+    DISPATCHER = ChatDispatcher(
+        WORKERS, max_lane_size=CONFIG.get("LANE_SIZE", 16))
+
+    if outbox.CONFIG["ENABLED"]:
+        outbox.start()
+
+    if CONFIG.get("STATS", {}).get("ENABLED", False):
+        start_stats_server()
+
+    if polling:
+        run_polling()
+    else:
+        run_webhook()
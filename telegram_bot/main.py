@@ -1,14 +1,28 @@
 import os
+import logging
 os.chdir(os.path.dirname(__file__))
 
 from core import server
+from core import client
 from core import database
+from core import schema
+from core import outbox
+from core import callbacks
 from modules.weather import Weather
 from modules.shortcuts import Shortcuts,sc
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     database.setup("config.json")
+    schema.migrate()
+
+    if database.MAINTENANCE["ENABLED"]:
+        schema.enable_incremental_vacuum()
+
+    client.setup("config.json")
+    outbox.setup("config.json")
+    callbacks.setup("config.json")
     server.setup("config.json",[Weather,Shortcuts,sc])
 
     server.run()
\ No newline at end of file
@@ -1,12 +1,18 @@
 import json
+import difflib
+import logging
 import sqlite3
+import threading
 import core.database as db
 from typing import Iterable
 from utils.api.methods import TelegramMethods, SendMessage
 from utils.api.objects import InlineKeyboardMarkup
+from utils.server.reply import RunCommand
 from utils.server.session import UserSession
 from utils.templates import render_response_template
 
+logger = logging.getLogger(__name__)
+
 
 class Shortcuts:
     """
@@ -28,6 +34,16 @@ class Shortcuts:
     hook = "/shortcuts"
     description = "Set custom messages / commands"
 
+    # Shortcuts shown per page of the show / modify views
+    page_size = 10
+
+    # Similar names compared when no name starts with the prefix
+    fuzzy_candidates = 500
+    fuzzy_cutoff = 0.5
+
+    # Users whose shortcuts may still be in the legacy command_list blobs
+    _blobs_migrated = threading.Event()
+
     def __init__(self, chat_id: int, user_id: int) -> None:
 
         try:
@@ -71,20 +87,167 @@ class Shortcuts:
 
         return InlineKeyboardMarkup(labels, commands)
 
-    def _db_get(self) -> list[dict]:
+    @classmethod
+    def setup(cls, config_path: str) -> None:
         """
-        Query database for saved command list. 
+        Configure the module and start moving the legacy blobs to the shortcut table
+
+        Args:
+            config_path: path to a JSON config file
+
+        Raises:
+            IOError: Config file cannot be read
+            json.JSONDecodeError: Invaild JSON
+        """
+
+        with open(config_path) as f:
+            config = json.load(f).get("shortcuts", {})
+
+        cls.page_size = max(1, config.get("PAGE_SIZE", cls.page_size))
+        cls.fuzzy_candidates = max(1, config.get("FUZZY_CANDIDATES", cls.fuzzy_candidates))
+
+        legacy = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'shortcuts'")
+
+        if legacy == []:
+            cls._blobs_migrated.set()
+            return
+
+        threading.Thread(target=cls._migrate_blobs,
+                         name="shortcuts-migration", daemon=True).start()
+
+    @classmethod
+    def _migrate_blobs(cls) -> None:
+        """Move every legacy command_list blob, one user per transaction"""
+
+        try:
+            for (user_id,) in db.execute("SELECT user_id FROM shortcuts"):
+                cls._migrate_user(user_id)
+
+        except sqlite3.Error:
+            logger.exception(
+                "Failed to migrate shortcuts, the remaining ones are moved on the next start")
+
+        finally:
+            cls._blobs_migrated.set()
+
+    @staticmethod
+    def _migrate_user(user_id: int) -> None:
+        """
+        Move the command_list blob of a user to the shortcut table, after
+        the shortcuts the user may already have there
+        """
+
+        with db.transaction(immediate=True) as cur:
+            query = cur.execute(
+                "SELECT command_list FROM shortcuts WHERE user_id = ?", (user_id,)).fetchall()
+
+            if query == []:
+                return
+
+            start = cur.execute(
+                "SELECT COALESCE(MAX(position), -1) + 1 FROM shortcut WHERE user_id = ?", (user_id,)).fetchall()[0][0]
+
+            rows = [
+                (user_id, start + position, name, command)
+                for position, item in enumerate(json.loads(query[0][0]))
+                for name, command in item.items()
+            ]
+
+            cur.executemany("INSERT INTO shortcut VALUES (?,?,?,?)", rows)
+            cur.execute("DELETE FROM shortcuts WHERE user_id = ?", (user_id,))
+
+    def _db_ready(self) -> None:
+        """Ensure the shortcuts of the user have been migrated"""
+
+        if not self._blobs_migrated.is_set():
+            self._migrate_user(self.user_id)
+
+    def _db_get(self, after: int = None, before: int = None) -> tuple[list[tuple[int, str, str]], bool, bool]:
+        """
+        Query database for a page of the saved command list. 
+
+        Only the rows of the page are read, using the position as the cursor.
+
+        Args:
+            after (optional): page starting after this position
+            before (optional): page ending before this position
+
+        Returns:
+            list of (position, name, command), has previous page, has next page
+
+        Raises:
+            sqlite3.Error: Database error
+        """
+        self._db_ready()
+
+        if before is not None:
+            rows = db.execute(
+                "SELECT position, name, command FROM shortcut WHERE user_id = ? AND position < ? ORDER BY position DESC LIMIT ?",
+                (self.user_id, before, self.page_size + 1))
+
+            has_prev = len(rows) > self.page_size
+            return rows[self.page_size - 1::-1], has_prev, True
+
+        rows = db.execute(
+            "SELECT position, name, command FROM shortcut WHERE user_id = ? AND position > ? ORDER BY position LIMIT ?",
+            (self.user_id, -1 if after is None else after, self.page_size + 1))
+
+        has_next = len(rows) > self.page_size
+        return rows[:self.page_size], after is not None, has_next
+
+    def _db_find(self, prefix: str) -> tuple[list[tuple[int, str, str]], bool]:
+        """
+        Find shortcuts by name, ignoring case.
+
+        Names starting with the prefix are found with a range scan of the
+        shortcut_name index. If there are none, names similar to the prefix
+        are returned ranked by similarity. Only names whose length can reach
+        the similarity cutoff are compared, at most fuzzy_candidates of them.
+
+        Args:
+            prefix: start of the shortcut name
 
         Returns:
-            list of key:value pair
+            list of (position, name, command), True if the matches are fuzzy
 
         Raises:
             sqlite3.Error: Database error
         """
-        query = db.execute(
-            "SELECT command_list FROM shortcuts WHERE user_id = ?", (self.user_id,))
+        self._db_ready()
 
-        return json.loads(query[0][0]) if (query != []) else []
+        rows = db.execute(
+            """
+            SELECT position, name, command FROM shortcut
+            WHERE user_id = ? AND name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE
+            ORDER BY name COLLATE NOCASE LIMIT ?
+            """,
+            (self.user_id, prefix, prefix + "\U0010ffff", self.page_size))
+
+        if rows != []:
+            return rows, False
+
+        # ratio = 2 * matches / (len(a) + len(b)) >= cutoff bounds len(b)
+        cutoff = self.fuzzy_cutoff
+        min_length = int(len(prefix) * cutoff / (2 - cutoff))
+        max_length = int(len(prefix) * (2 - cutoff) / cutoff) + 1
+
+        rows = db.execute(
+            """
+            SELECT position, name, command FROM shortcut
+            WHERE user_id = ? AND length(name) BETWEEN ? AND ?
+            ORDER BY abs(length(name) - ?) LIMIT ?
+            """,
+            (self.user_id, min_length, max_length, len(prefix), self.fuzzy_candidates))
+
+        names = {}
+        for row in rows:
+            names.setdefault(row[1].lower(), row)
+
+        matches = difflib.get_close_matches(
+            prefix.lower(), names.keys(), n=self.page_size, cutoff=cutoff)
+
+        return [names[name] for name in matches], True
 
     def _db_add(self, name: str, command: str) -> str:
         """
@@ -96,21 +259,18 @@ class Shortcuts:
         Raises: 
             sqlite3.Error: Database error
         """
-
-        command_list = self._db_get()
-        command_list.append({name: command})
+        self._db_ready()
 
         db.execute_and_commit(
             """
-            INSERT INTO shortcuts 
-            VALUES(:user_id,:command_list) 
-            ON CONFLICT(user_id) 
-            DO UPDATE SET command_list=:command_list 
-            WHERE user_id = :user_id
+            INSERT INTO shortcut (user_id, position, name, command)
+            SELECT :user_id, COALESCE(MAX(position), -1) + 1, :name, :command
+            FROM shortcut WHERE user_id = :user_id
             """,
             {
                 "user_id": self.user_id,
-                "command_list": json.dumps(command_list)
+                "name": name,
+                "command": command
             }
         )
 
@@ -127,34 +287,31 @@ class Shortcuts:
             sqlite3.Error: Database error
             IndexError: Invaild Indexes
         """
+        self._db_ready()
 
-        msg = ""
-
-        command_list = self._db_get()
-        if command_list == None:
-            return "Failed: there is no commands to remove"
+        indexes = tuple(set(indexes))
 
-        # TODO: Check for invaild indexes
-        command_list = [i for j, i in enumerate(
-            command_list) if j not in indexes]
+        with db.transaction() as cur:
+            deleted = cur.execute(
+                f"""
+                DELETE FROM shortcut
+                WHERE user_id = ? AND position IN ({",".join("?" * len(indexes))})
+                RETURNING position
+                """,
+                (self.user_id, *indexes)
+            ).fetchall()
 
-        if len(command_list) == 0:
-            msg += f"Success: The list is now empty."
-            sql = "DELETE from shortcuts WHERE user_id = :user_id;"
+            if len(deleted) != len(indexes):
+                missing = set(indexes) - {i for (i,) in deleted}
+                raise IndexError(f"No shortcut at: {sorted(missing)}")
 
-        else:
-            msg += f"Succeeded!"
-            sql = """
-                UPDATE shortcuts SET command_list = :command_list
-                WHERE user_id = :user_id;
-                """
+            remaining = cur.execute(
+                "SELECT EXISTS(SELECT 1 FROM shortcut WHERE user_id = ?)", (self.user_id,)).fetchall()
 
-        db.execute_and_commit(sql, {
-            "user_id": self.user_id,
-            "command_list": json.dumps(list(command_list))
-        })
+        if remaining[0][0] == 0:
+            return f"Success: The list is now empty."
 
-        return msg
+        return f"Succeeded!"
 
     def _db_edit(self, index: int, name: str, command: str) -> str:
         """
@@ -167,22 +324,24 @@ class Shortcuts:
             sqlite3.Error: Database error
             IndexError: Invaild index
         """
+        self._db_ready()
 
-        command_list = self._db_get()
-        if command_list == []:
-            return "There is no commands to edit"
-
-        command_list[index] = {name: command}
-
-        sql = """ 
-            UPDATE shortcuts SET command_list = :command_list
-            WHERE user_id = :user_id;
+        edited = db.execute_and_commit(
             """
+            UPDATE shortcut SET name = :name, command = :command
+            WHERE user_id = :user_id AND position = :position
+            RETURNING position
+            """,
+            {
+                "user_id": self.user_id,
+                "position": index,
+                "name": name,
+                "command": command
+            }
+        )
 
-        db.execute_and_commit(sql, {
-            "user_id": self.user_id,
-            "command_list": json.dumps(list(command_list))
-        })
+        if edited == []:
+            raise IndexError(f"No shortcut at: {index}")
 
         return "Succeeded!"
 
@@ -239,6 +398,12 @@ class Shortcuts:
 
         action = args[2]
 
+        # Page through the list while still listening for a modification
+        if action in ["next", "prev"]:
+            replies = self._shortcuts_show_reply(args, show_full=True)
+            self.session.update_state(" ".join(args[0:2]), True)
+            return replies
+
         try:
             if action == "add" and argc == 5:
                 msg = self._db_add(args[3], args[4])  # DBError
@@ -278,30 +443,64 @@ class Shortcuts:
             return self._exception_reply(args[0:2], f"Index given not in saved list", additional_info=str(e), listen_for_additional_args=True)
 
     def _shortcuts_show_reply(self, args, show_full=False) -> list[TelegramMethods]:
-        """Query database and replies with a message with InlineMarkup"""
+        """
+        Query database and replies with a page of shortcuts with InlineMarkup
+
+        Pages are selected with: [hook] [show/modify] [next/prev] [POSITION]
+        """
 
         assert (args[1] == "show" or args[1] == "modify")
 
         try:
-            command_list = self._db_get()
+            after, before = None, None
+
+            if len(args) == 4 and args[2] == "next":
+                after = int(args[3])  # ValueError
+
+            elif len(args) == 4 and args[2] == "prev":
+                before = int(args[3])  # ValueError
+
+            elif len(args) > 2 and args[1] == "show":
+                raise ValueError(f"Expected: next/prev POSITION, got: {' '.join(args[2:])}")
+
+            command_list, has_prev, has_next = self._db_get(after, before)
+
+            # Items on the requested page were deleted
+            if command_list == [] and (after is not None or before is not None):
+                command_list, has_prev, has_next = self._db_get()
 
             if command_list != []:
 
                 labels = []
                 callback_data = []
 
-                for i, command in enumerate(command_list):
-                    for name, data in command.items():
+                for i, name, data in command_list:
+
+                    if show_full == True:
+                        labels.append(
+                            [f"{i}. " + name + f"  [{str(data)}]"])
+                    else:
+                        labels.append([f"{i}. " + name])
+
+                    callback_data.append([data])
+
+                nav_labels, nav_data = [], []
 
-                        if show_full == True:
-                            labels.append(
-                                [f"{i}. " + name + f"  [{str(data)}]"])
-                        else:
-                            labels.append([f"{i}. " + name])
+                if has_prev:
+                    nav_labels.append("« Prev")
+                    nav_data.append(
+                        f"{self.hook} {args[1]} prev {command_list[0][0]}")
 
-                        callback_data.append([data])
+                if has_next:
+                    nav_labels.append("Next »")
+                    nav_data.append(
+                        f"{self.hook} {args[1]} next {command_list[-1][0]}")
 
-                return self._simple_reply(args, "Saved shortcuts:", reply_markup=InlineKeyboardMarkup(labels, callback_data))
+                if nav_labels != []:
+                    labels.append(nav_labels)
+                    callback_data.append(nav_data)
+
+                return self._simple_reply(args[0:2], "Saved shortcuts:", reply_markup=InlineKeyboardMarkup(labels, callback_data))
 
             else:
                 return self._simple_reply(args[0:2], "Your shortcuts list is empty")
@@ -309,6 +508,53 @@ class Shortcuts:
         except sqlite3.Error as e:
             return self._exception_reply(args[0:2], "A database error occured", additional_info=str(e), listen_for_additional_args=True)
 
+        except ValueError as e:
+            return self._exception_reply(args[0:2], "Illegal arguments type", additional_info=str(e))
+
+    def _shortcuts_run_reply(self, args) -> list[TelegramMethods]:
+        """
+        Run a saved shortcut by name: [hook] run [NAME PREFIX]
+
+        The command of the shortcut is returned as a RunCommand for the
+        server to handle. Several or only similar matches are shown as
+        buttons instead.
+        """
+
+        assert (args[1] == "run")
+
+        if len(args) == 2:
+            return self._shortcuts_show_reply(args[0:1] + ("show",))
+
+        prefix = " ".join(args[2:])
+
+        try:
+            matches, fuzzy = self._db_find(prefix)
+
+        except sqlite3.Error as e:
+            return self._exception_reply(args, "A database error occured", additional_info=str(e))
+
+        if matches == []:
+            return self._simple_reply(args, "No saved shortcut matches")
+
+        exact = [m for m in matches if m[1].lower() == prefix.lower()]
+
+        if not fuzzy and (len(matches) == 1 or len(exact) == 1):
+            command = (exact or matches)[0][2]
+
+            # A shortcut running shortcuts could run itself forever
+            words = command.lower().split()
+
+            if words[0:1] == [sc.hook] or words[0:2] == [self.hook, "run"]:
+                return self._exception_reply(args, "Shortcut cannot run other shortcuts")
+
+            return [RunCommand(command)]
+
+        labels = [[f"{i}. " + name] for i, name, _ in matches]
+        callback_data = [[command] for _, _, command in matches]
+
+        msg = "Did you mean:" if fuzzy else "Matching shortcuts:"
+        return self._simple_reply(args, msg, reply_markup=InlineKeyboardMarkup(labels, callback_data))
+
     def _shortcuts_help_reply(self, args) -> list[TelegramMethods]:
         """Render and send the help response"""
 
@@ -353,9 +599,17 @@ class Shortcuts:
 
 
 class sc:
+    """
+    Show saved shortcuts, or run a saved shortcut by name: /sc [NAME PREFIX]
+    """
+
     hook = "/sc"
-    description = "Show saved shortcuts"
+    description = "Show / run saved shortcuts"
 
     @staticmethod
-    def get_reply(*args,**kwargs):
-        return Shortcuts.get_reply(*(Shortcuts.hook,"show",),**kwargs)
+    def get_reply(*args, **kwargs):
+
+        if len(args) == 1:
+            return Shortcuts.get_reply(*(Shortcuts.hook, "show",), **kwargs)
+
+        return Shortcuts.get_reply(Shortcuts.hook, "run", *args[1:], **kwargs)
@@ -1,5 +1,11 @@
+import os
+import json
+import time
+import logging
 import requests
 import functools
+import threading
+import numpy as np
 
 from requests.exceptions import HTTPError
 from datetime import datetime, timedelta
@@ -7,15 +13,313 @@ from PIL import Image
 from io import BytesIO
 
 from utils.api.objects import InlineKeyboardMarkup
+from utils.cache import LRUCache, SingleFlight
+from utils.scheduler import Scheduler
 from utils.templates import render_response_template
 from utils.general import round_datetime
 from utils.api.methods import *
 
+logger = logging.getLogger(__name__)
+
+RAINMAP_STATIC_URLS = (
+    "http://www.weather.gov.sg/wp-content/themes/wiptheme/assets/img/base-853.png",
+    "http://www.weather.gov.sg/wp-content/themes/wiptheme/images/SG-Township.png",
+)
+
+# Opacity of the radar overlay drawn over the base map
+RAINMAP_OVERLAY_ALPHA = 70
+
+RAINMAP_OVERLAY_URL = "http://www.weather.gov.sg/files/rainarea/50km/v2/dpsri_70km_{:%Y%m%d%H%M}0000dBR.dpsri.png"
+
+FORECAST_API = {
+    "forecast24": "https://api.data.gov.sg/v1/environment/24-hour-weather-forecast",
+    "forecast4d": "https://api.data.gov.sg/v1/environment/4-day-weather-forecast",
+}
+
+CONFIG = {
+    "TIMEOUT": 10,
+    "FORECAST_MIN_TTL": 300,
+    "FORECAST_UPDATE_INTERVAL": {
+        "forecast24": 6 * 3600,
+        "forecast4d": 12 * 3600,
+    },
+    "CACHE_DIR": "cache/weather",
+    "RAINMAP_LOOKBACK": 10,
+    "RAINMAP_OVERLAYS": 12,
+    "RAINMAP_FRAMES": 5,
+    "RAINMAP_MISSING_TTL": 60,
+    "RAINMAP_ENCODING": {
+        "FORMAT": "png",
+        "PALETTE_COLORS": 0,
+        "COMPRESS_LEVEL": 6,
+        "QUALITY": 80,
+    },
+    "PREFETCH": {
+        "ENABLED": False,
+        "FORECAST_INTERVAL": 1800,
+        "RAINMAP_INTERVAL": 300,
+        "JITTER": 0.1,
+        "RETRY": 30,
+        "STALE_GRACE": 900,
+    },
+}
+
 
 class Weather:
     hook = "/weather"
     description = "Singapore Weather"
 
+    # Forecasts by endpoint, expiring when the next update is expected
+    _forecasts = LRUCache(maxsize=len(FORECAST_API))
+    _forecast_flight = SingleFlight()
+
+    # Last good data, served while the prefetcher refreshes it:
+    # endpoint -> (expires, forecast) and (fetched, rainmap time, photo)
+    _stale_forecasts: dict[str, tuple[float, dict]] = {}
+    _latest_rainmap: tuple[float, datetime, bytes] = None
+    _prefetcher = Scheduler("weather-prefetch")
+
+    # Rainmap assets: static layers, radar overlays by 5 min slot and
+    # encoded frames by frame time. False marks a slot with no overlay.
+    _static_layers: tuple[Image.Image, Image.Image] = None
+    _base_layers: tuple[Image.Image, Image.Image, Image.Image] = None
+    _overlays = LRUCache(maxsize=CONFIG["RAINMAP_OVERLAYS"])
+    _frames = LRUCache(maxsize=CONFIG["RAINMAP_FRAMES"])
+    _rainmap_flight = SingleFlight()
+    _encode_stats = {"frames": 0, "total_time": 0.0, "total_bytes": 0, "last_bytes": 0}
+
+    _http = requests.Session()
+    _stats_lock = threading.Lock()
+    _upstream = {}  # endpoint -> request counters
+
+    @classmethod
+    def setup(cls, config_path: str) -> None:
+        """
+        Configure the module using a config file
+
+        Args:
+            config_path: path to a JSON config file
+
+        Raises:
+            IOError: Config file cannot be read
+            json.JSONDecodeError: Invaild JSON
+        """
+
+        with open(config_path) as f:
+            config = json.load(f).get("weather", {})
+
+        CONFIG["FORECAST_UPDATE_INTERVAL"].update(
+            config.pop("FORECAST_UPDATE_INTERVAL", {}))
+        CONFIG["PREFETCH"].update(config.pop("PREFETCH", {}))
+        CONFIG["RAINMAP_ENCODING"].update(config.pop("RAINMAP_ENCODING", {}))
+        CONFIG.update(config)
+
+        cls._overlays = LRUCache(maxsize=CONFIG["RAINMAP_OVERLAYS"])
+        cls._frames = LRUCache(maxsize=CONFIG["RAINMAP_FRAMES"])
+
+        if CONFIG["PREFETCH"]["ENABLED"]:
+            cls._start_prefetch()
+
+    @classmethod
+    def _start_prefetch(cls) -> None:
+        """Refresh forecasts and the rainmap in the background"""
+
+        prefetch = CONFIG["PREFETCH"]
+
+        for endpoint in FORECAST_API:
+            cls._prefetcher.add(
+                endpoint,
+                functools.partial(cls._refresh_forecast, endpoint),
+                interval=prefetch["FORECAST_INTERVAL"],
+                jitter=prefetch["JITTER"],
+                retry=prefetch["RETRY"]
+            )
+
+        cls._prefetcher.add(
+            "rainmap",
+            cls._refresh_rainmap,
+            interval=prefetch["RAINMAP_INTERVAL"],
+            jitter=prefetch["JITTER"],
+            retry=prefetch["RETRY"]
+        )
+
+        cls._prefetcher.start()
+
+    @classmethod
+    def _refresh_forecast(cls, endpoint: str) -> None:
+        """Download a forecast even if it is cached"""
+        cls._forecast_flight.do(endpoint, cls._download_forecast, endpoint)
+
+    @classmethod
+    def _refresh_rainmap(cls) -> None:
+        """Fetch the newest rainmap frame, composing the base layers on the first run"""
+        cls._latest_rainmap = (time.time(), *cls._fetch_rainmap_api())
+
+    @classmethod
+    def _get_stale_forecast(cls, endpoint: str):
+        """Last forecast of an endpoint, None if it expired more than STALE_GRACE ago"""
+
+        stale = cls._stale_forecasts.get(endpoint)
+
+        if stale is None or stale[0] + CONFIG["PREFETCH"]["STALE_GRACE"] < time.time():
+            return None
+
+        return stale[1]
+
+    @classmethod
+    def _get_latest_rainmap(cls):
+        """Last prefetched rainmap (time, photo), None if older than RAINMAP_INTERVAL + STALE_GRACE"""
+
+        latest = cls._latest_rainmap
+        prefetch = CONFIG["PREFETCH"]
+
+        if latest is None or latest[0] + prefetch["RAINMAP_INTERVAL"] + prefetch["STALE_GRACE"] < time.time():
+            return None
+
+        return latest[1:]
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        """
+        Get cache and upstream counters of the module
+
+        Returns:
+            dict of forecast cache counters and upstream latency per endpoint
+        """
+
+        with cls._stats_lock:
+            encode = dict(cls._encode_stats)
+
+            upstream = {
+                name: {
+                    **counters,
+                    "avg_time": round(counters["total_time"] / counters["requests"], 4) if counters["requests"] else 0.0,
+                }
+                for name, counters in cls._upstream.items()
+            }
+
+        return {
+            "forecast_cache": cls._forecasts.stats(),
+            "forecast_fetch": cls._forecast_flight.stats(),
+            "upstream": upstream,
+            "prefetch": cls._prefetcher.stats(),
+            "rainmap_overlays": cls._overlays.stats(),
+            "rainmap_frames": cls._frames.stats(),
+            "rainmap_encode": {
+                "format": CONFIG["RAINMAP_ENCODING"]["FORMAT"],
+                **encode,
+                "avg_time": round(encode["total_time"] / encode["frames"], 4) if encode["frames"] else 0.0,
+                "avg_bytes": encode["total_bytes"] // encode["frames"] if encode["frames"] else 0,
+            },
+        }
+
+    @classmethod
+    def _get(cls, name: str, url: str, **kwargs) -> requests.Response:
+        """GET an upstream url with the configured timeout, recording its latency"""
+
+        start = time.perf_counter()
+        error = True
+
+        try:
+            r = cls._http.get(url, timeout=CONFIG["TIMEOUT"], **kwargs)
+            error = r.status_code >= 400
+            return r
+
+        finally:
+            elapsed = time.perf_counter() - start
+
+            with cls._stats_lock:
+                counters = cls._upstream.setdefault(
+                    name, {"requests": 0, "errors": 0, "total_time": 0.0, "max_time": 0.0})
+
+                counters["requests"] += 1
+                counters["errors"] += error
+                counters["total_time"] += elapsed
+                counters["max_time"] = max(counters["max_time"], elapsed)
+
+    @classmethod
+    def _forecast_ttl(cls, endpoint: str, forecast: dict) -> float:
+        """Seconds until the next update of a forecast is expected"""
+
+        min_ttl = CONFIG["FORECAST_MIN_TTL"]
+        interval = CONFIG["FORECAST_UPDATE_INTERVAL"][endpoint]
+
+        try:
+            updated = datetime.fromisoformat(forecast["update_timestamp"])
+            ttl = updated.timestamp() + interval - time.time()
+
+        except (KeyError, TypeError, ValueError):
+            return min_ttl
+
+        # Update is late, check again soon
+        return min(max(ttl, min_ttl), interval)
+
+    @classmethod
+    def _fetch_forecast(cls, endpoint: str) -> dict:
+        """
+        Get a forecast, from the cache or from the api.
+
+        Concurrent misses of an endpoint wait for a single api call. While
+        the prefetcher is running, or if the api fails, the last forecast
+        is returned instead of waiting for the api, as long as it expired
+        less than STALE_GRACE seconds ago.
+
+        Args:
+            endpoint: key of FORECAST_API
+
+        Returns:
+            API response (dict)
+
+        Raises:
+            requests.HTTPError: API error
+            requests.RequestException: Connection error / timeout
+        """
+
+        forecast = cls._forecasts.get(endpoint)
+
+        if forecast is not None:
+            return forecast
+
+        stale = cls._get_stale_forecast(endpoint)
+
+        if stale is not None and cls._prefetcher.is_running():
+            return stale
+
+        try:
+            return cls._forecast_flight.do(endpoint, cls._load_forecast, endpoint)
+
+        except requests.RequestException as e:
+            if stale is None:
+                raise
+
+            logger.warning("Serving stale %s: %s", endpoint, e)
+            return stale
+
+    @classmethod
+    def _load_forecast(cls, endpoint: str) -> dict:
+
+        # Loaded by a call that finished after the cache was checked
+        forecast = cls._forecasts.peek(endpoint)
+
+        if forecast is not None:
+            return forecast
+
+        return cls._download_forecast(endpoint)
+
+    @classmethod
+    def _download_forecast(cls, endpoint: str) -> dict:
+
+        api_response = cls._get(endpoint, FORECAST_API[endpoint])
+        api_response.raise_for_status()
+
+        forecast = api_response.json()['items'][0]
+        ttl = cls._forecast_ttl(endpoint, forecast)
+
+        cls._forecasts.set(endpoint, forecast, ttl=ttl)
+        cls._stale_forecasts[endpoint] = (time.time() + ttl, forecast)
+
+        return forecast
+
     @classmethod
     def _inline_hook_reply(cls, chat_id: int, *args) -> list[TelegramMethods]:
         """Return message with inline keyboard"""
@@ -70,8 +374,8 @@ class Weather:
 
         return [reply]
 
-    @staticmethod
-    def _fetch_forecast24_api() -> dict:
+    @classmethod
+    def _fetch_forecast24_api(cls) -> dict:
         """
         Fetch 24 hour forecast from api.
 
@@ -82,14 +386,10 @@ class Weather:
             requests.HTTPError: API error
         """
 
-        api_response = requests.get(
-            url='https://api.data.gov.sg/v1/environment/24-hour-weather-forecast')
-        api_response.raise_for_status()
-
-        return api_response.json()['items'][0]
+        return cls._fetch_forecast("forecast24")
 
-    @staticmethod
-    def _fetch_forecast4d_api() -> dict:
+    @classmethod
+    def _fetch_forecast4d_api(cls) -> dict:
         """
         Fetches 4 day forecasts from api.
 
@@ -100,90 +400,276 @@ class Weather:
             requests.HTTPError: API error
         """
 
-        api_response = requests.get(
-            url='https://api.data.gov.sg/v1/environment/4-day-weather-forecast')
-        api_response.raise_for_status()
-
-        return api_response.json()['items'][0]
+        return cls._fetch_forecast("forecast4d")
 
-    @staticmethod
-    def _fetch_rainmap_api(dt: datetime = datetime.now()) -> tuple[datetime, bytes]:
+    @classmethod
+    def _get_static_layers(cls) -> tuple[Image.Image, Image.Image]:
         """
-        Fetches rainmaps images from api.
+        Get the base map and township layers of the rainmap.
+
+        Downloaded once and saved in CACHE_DIR, later loaded from disk.
 
         Returns:
-            last updated time and photo (datetime,bytes)
+            base, township images
 
         Raises:
             requests.HTTPError: API error
         """
 
-        @functools.cache
-        def get_static_images():
-            static_images_url = [
-                "http://www.weather.gov.sg/wp-content/themes/wiptheme/assets/img/base-853.png",
-                "http://www.weather.gov.sg/wp-content/themes/wiptheme/images/SG-Township.png",
-            ]
+        if cls._static_layers is None:
+            cls._static_layers = cls._rainmap_flight.do(
+                "static", cls._load_static_layers)
+
+        return cls._static_layers
+
+    @classmethod
+    def _load_static_layers(cls) -> tuple[Image.Image, Image.Image]:
+
+        if cls._static_layers is not None:
+            return cls._static_layers
+
+        images = []
+
+        for url in RAINMAP_STATIC_URLS:
+            path = os.path.join(CONFIG["CACHE_DIR"], os.path.basename(url))
 
-            images = []
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
 
-            for url in static_images_url:
-                r = requests.get(url, stream=True)
+            except FileNotFoundError:
+                r = cls._get("rainmap_static", url)
                 r.raise_for_status()
+                data = r.content
+
+                try:
+                    os.makedirs(CONFIG["CACHE_DIR"], exist_ok=True)
+
+                    with open(path + ".tmp", "wb") as f:
+                        f.write(data)
 
-                r.raw.decode_content = True
-                images.append(Image.open(r.raw))
+                    os.replace(path + ".tmp", path)
 
-            return tuple(images)
+                except OSError as e:
+                    logger.warning("Unable to save %s: %s", path, e)
 
-        max_it = 10
+            image = Image.open(BytesIO(data))
+            image.load()
+            images.append(image)
 
-        @functools.lru_cache(10)
-        def get_rain_overlay(time: datetime) -> tuple[datetime, Image.Image]:
-            nonlocal max_it
+        return tuple(images)
 
-            time = round_datetime(time, 5)  # round to nearest 5mins
+    @classmethod
+    def _get_rain_overlay(cls, dt: datetime) -> tuple[datetime, Image.Image]:
+        """
+        Get the newest radar overlay at or before dt.
 
-            url = f"http://www.weather.gov.sg/files/rainarea/50km/v2/dpsri_70km_{time.strftime('%Y%m%d%H%M')}0000dBR.dpsri.png"
-            r = requests.get(url, stream=True)
+        Overlays are published every 5 mins, slots without an overlay are
+        looked up again after RAINMAP_MISSING_TTL seconds.
 
-            if r.status_code == 200:
-                r.raw.decode_content = True
-                return time, Image.open(r.raw)
+        Returns:
+            time of the overlay, overlay image
 
-            elif max_it > 0:
-                max_it = max_it - 1
+        Raises:
+            requests.HTTPError: No overlay in the last RAINMAP_LOOKBACK slots
+        """
 
-                return get_rain_overlay(time - timedelta(minutes=5))
+        slot = round_datetime(dt, 5)  # round to nearest 5mins
 
-            else:
-                # Max iterations
-                r.status_code = 404  # Force HTTP error to raise
-                r.raise_for_status()
-                raise HTTPError
+        for _ in range(CONFIG["RAINMAP_LOOKBACK"]):
+            overlay = cls._overlays.get(slot)
+
+            if overlay is None:
+                overlay = cls._rainmap_flight.do(
+                    slot, cls._load_rain_overlay, slot)
+
+            if overlay is not False:
+                return slot, overlay
+
+            slot = slot - timedelta(minutes=5)
+
+        raise HTTPError(
+            f"No rainmap in the last {CONFIG['RAINMAP_LOOKBACK']} frames")
+
+    @classmethod
+    def _load_rain_overlay(cls, slot: datetime):
+
+        overlay = cls._overlays.peek(slot)
+
+        if overlay is not None:
+            return overlay
+
+        r = cls._get("rainmap_overlay", RAINMAP_OVERLAY_URL.format(slot))
+
+        if r.status_code == 200:
+            overlay = Image.open(BytesIO(r.content))
+            overlay.load()
+            cls._overlays.set(slot, overlay)
+
+        elif r.status_code in (403, 404):
+            overlay = False  # Not published (yet)
+            cls._overlays.set(slot, overlay, ttl=CONFIG["RAINMAP_MISSING_TTL"])
+
+        else:
+            r.raise_for_status()
+
+        return overlay
+
+    @classmethod
+    def _get_base_layers(cls) -> tuple[Image.Image, Image.Image, Image.Image]:
+        """
+        Get the static layers precomposed for blending overlays.
+
+        Drawing the overlay O with alpha a over the base B, then the
+        township T with alpha t over it gives P + O·W, where
+        P = B(1-a)(1-t) + Tt and W = a(1-t) are the same for every frame.
+        Written as Q(1-W) + O·W with Q = P / (1-W), a frame is a single
+        Image.composite() of the overlay over Q with W as the mask. The
+        overlay alpha is constant, so the alpha channel of the frame is
+        fixed as well.
+
+        Returns:
+            Q (RGB), W (L mask), alpha channel of the frame (L)
+        """
+
+        if cls._base_layers is None:
+            cls._base_layers = cls._rainmap_flight.do(
+                "base", cls._compose_base_layers)
+
+        return cls._base_layers
+
+    @classmethod
+    def _compose_base_layers(cls) -> tuple[Image.Image, Image.Image, Image.Image]:
+
+        if cls._base_layers is not None:
+            return cls._base_layers
+
+        base, town = cls._get_static_layers()
+
+        base = base.convert("RGBA")
+        town = np.asarray(town.resize(base.size).convert("RGBA"), dtype=np.float32)
+        base = np.asarray(base, dtype=np.float32)
+
+        a = RAINMAP_OVERLAY_ALPHA / 255
+        t = town[..., 3:] / 255
 
-        @functools.lru_cache(5)
-        def sitch_images(rainmap_time: datetime) -> tuple[datetime, bytes]:
-            nonlocal static_images
-            nonlocal overlay
+        precomposed = base * (1 - a) * (1 - t) + town * t
+        weight = a * (1 - t)
 
-            base = static_images[0].convert("RGBA")
-            town = static_images[1].resize(base.size).convert("RGBA")
-            overlay = overlay.resize(base.size).convert("RGBA")
-            overlay.putalpha(70)
-            base.paste(overlay, (0, 0), overlay)
-            base.paste(town, (0, 0), town)
+        def to_image(array, mode):
+            return Image.fromarray(np.clip(np.rint(array), 0, 255).astype(np.uint8), mode)
 
-            photo = BytesIO()
-            base.save(photo, 'PNG')
-            photo.seek(0)
+        return (
+            to_image(precomposed[..., :3] / (1 - weight), "RGB"),
+            to_image(weight[..., 0] * 255, "L"),
+            to_image(precomposed[..., 3] + RAINMAP_OVERLAY_ALPHA * weight[..., 0], "L"),
+        )
+
+    @classmethod
+    def _composite(cls, overlay: Image.Image) -> Image.Image:
+        """Draw the overlay and township layer over the base map"""
+
+        base, mask, alpha = cls._get_base_layers()
+
+        frame = Image.composite(
+            overlay.resize(base.size).convert("RGB"), base, mask)
+        frame.putalpha(alpha)
+
+        return frame
+
+    @staticmethod
+    def _encode(frame: Image.Image) -> bytes:
+        """
+        Encode a rainmap frame as set in RAINMAP_ENCODING
+
+        FORMAT png: lossless, reduced to PALETTE_COLORS colours if set, with
+        zlib COMPRESS_LEVEL (0-9). FORMAT jpeg / webp: lossy at QUALITY (0-100).
+
+        Raises:
+            ValueError: Unsupported format
+        """
+
+        encoding = CONFIG["RAINMAP_ENCODING"]
+        image_format = encoding["FORMAT"].lower()
+        photo = BytesIO()
+
+        if image_format == "png":
+            if encoding["PALETTE_COLORS"]:
+                frame = frame.quantize(
+                    encoding["PALETTE_COLORS"], method=Image.Quantize.FASTOCTREE)
+
+            frame.save(photo, "PNG", compress_level=encoding["COMPRESS_LEVEL"])
+
+        elif image_format in ("jpeg", "jpg"):
+            frame.convert("RGB").save(photo, "JPEG", quality=encoding["QUALITY"])
+
+        elif image_format == "webp":
+            frame.save(photo, "WEBP", quality=encoding["QUALITY"])
+
+        else:
+            raise ValueError(f"Unsupported rainmap format: {image_format}")
+
+        # The only copy, sent as is
+        return photo.getvalue()
+
+    @classmethod
+    def _stitch_images(cls, rainmap_time: datetime, overlay: Image.Image) -> bytes:
+        """Draw and encode the rainmap of a frame"""
+
+        frame = cls._composite(overlay)
 
-            return rainmap_time, photo.read()
+        start = time.perf_counter()
+        photo = cls._encode(frame)
+        elapsed = time.perf_counter() - start
 
-        static_images = get_static_images()
-        rainmap_time, overlay = get_rain_overlay(dt)  # Snice the api is slow
+        with cls._stats_lock:
+            cls._encode_stats["frames"] += 1
+            cls._encode_stats["total_time"] += elapsed
+            cls._encode_stats["total_bytes"] += len(photo)
+            cls._encode_stats["last_bytes"] = len(photo)
 
-        return sitch_images(rainmap_time)
+        return photo
+
+    @classmethod
+    def _fetch_rainmap_api(cls, dt: datetime = None) -> tuple[datetime, bytes]:
+        """
+        Fetches rainmaps images from api.
+
+        Args:
+            dt (optional): newest frame time to use, defaults to 5 mins ago
+                as frames are published late
+
+        Returns:
+            last updated time and photo (datetime,bytes)
+
+        Raises:
+            requests.HTTPError: API error
+        """
+
+        if dt is None:
+            dt = datetime.now() - timedelta(minutes=5)
+
+        cls._get_static_layers()
+        rainmap_time, overlay = cls._get_rain_overlay(dt)
+
+        photo = cls._frames.get(rainmap_time)
+
+        if photo is None:
+            photo = cls._rainmap_flight.do(
+                ("frame", rainmap_time), cls._render_frame, rainmap_time, overlay)
+
+        return rainmap_time, photo
+
+    @classmethod
+    def _render_frame(cls, rainmap_time: datetime, overlay: Image.Image) -> bytes:
+
+        photo = cls._frames.peek(rainmap_time)
+
+        if photo is None:
+            photo = cls._stitch_images(rainmap_time, overlay)
+            cls._frames.set(rainmap_time, photo)
+
+        return photo
 
     @classmethod
     def _exception_reply(cls, chat_id: int, sub_mod_name: str, msg: str = "An Error Occured, please try again") -> list[TelegramMethods]:
@@ -236,7 +722,7 @@ class Weather:
 
                 return [response]
 
-            except HTTPError as e:
+            except requests.RequestException as e:
                 return cls._exception_reply(chat_id, args[1], "API Error, Please try again later")
             except Exception as e:
                 return cls._exception_reply(chat_id, args[1], str(e))
@@ -258,7 +744,7 @@ class Weather:
             reply = SendMessage(chat_id, text, parse_mode="HTML")
             return [reply]
 
-        except HTTPError as e:
+        except requests.RequestException as e:
             return cls._exception_reply(chat_id, args[1], "API Error, Please try again later")
 
     @classmethod
@@ -266,8 +752,12 @@ class Weather:
         assert args[1] == "rainmap"
 
         try:
-            rainmap_time, photo = cls._fetch_rainmap_api(
-                datetime.now() - timedelta(minutes=5))
+            latest = cls._get_latest_rainmap() if cls._prefetcher.is_running() else None
+
+            if latest is not None:
+                rainmap_time, photo = latest
+            else:
+                rainmap_time, photo = cls._fetch_rainmap_api()
             reply = SendPhoto(
                 chat_id,
                 photo,
@@ -276,7 +766,7 @@ class Weather:
 
             return [reply]
 
-        except HTTPError as e:
+        except requests.RequestException as e:
             return cls._exception_reply(chat_id, args[1], "API Error, Please try again later")
 
     @classmethod
@@ -0,0 +1,28 @@
+"""
+Unit tests, run from the telegram_bot directory:
+
+    python -m unittest discover -s tests -t .
+
+"""
+import os
+import tempfile
+import unittest
+
+import utils.api.methods  # Must be imported before utils.api.objects
+from core import database as db
+from core import schema
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """Test case connected to an empty, migrated database in a temporary directory"""
+
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+
+        self.db_path = os.path.join(self._tmp.name, "test.db")
+
+        db.connect(self.db_path)
+        self.addCleanup(db.disconnect)
+
+        schema.migrate()
@@ -0,0 +1,118 @@
+import time
+import threading
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from utils.cache import LRUCache, SingleFlight
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(maxsize=2)
+
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_entry_expires_after_ttl(self):
+        cache = LRUCache(maxsize=10, ttl=10)
+
+        with mock.patch("utils.cache.time.monotonic", return_value=100):
+            cache.set("a", 1)
+            cache.set("b", 2, ttl=30)
+
+        with mock.patch("utils.cache.time.monotonic", return_value=115):
+            self.assertIsNone(cache.get("a"))
+            self.assertEqual(cache.get("b"), 2)
+
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_peek_does_not_count_or_reorder(self):
+        cache = LRUCache(maxsize=2)
+
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        self.assertEqual(cache.peek("a"), 1)
+        cache.set("c", 3)
+
+        self.assertIsNone(cache.peek("a"))
+        self.assertEqual(cache.stats()["hits"], 0)
+        self.assertEqual(cache.stats()["misses"], 0)
+
+    def test_stats(self):
+        cache = LRUCache(maxsize=10)
+
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("missing")
+        cache.delete("a")
+
+        stats = cache.stats()
+
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+        self.assertEqual(stats["size"], 0)
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_share_one_call(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def load(key):
+            calls.append(key)
+            started.set()
+            release.wait(5)
+            return key * 2
+
+        with ThreadPoolExecutor(8) as pool:
+            leader = pool.submit(flight.do, 21, load, 21)
+            started.wait(5)
+
+            followers = [pool.submit(flight.do, 21, load, 21) for _ in range(7)]
+
+            # Followers are waiting on the running call
+            while flight.stats()["shared"] < 7:
+                time.sleep(0.001)
+
+            release.set()
+            results = [f.result(5) for f in [leader, *followers]]
+
+        self.assertEqual(results, [42] * 8)
+        self.assertEqual(calls, [21])
+        self.assertEqual(flight.stats(), {"calls": 1, "shared": 7, "in_flight": 0})
+
+    def test_exception_is_raised_and_not_cached(self):
+        flight = SingleFlight()
+
+        def fail():
+            raise ValueError("upstream down")
+
+        with self.assertRaises(ValueError):
+            flight.do("key", fail)
+
+        self.assertEqual(flight.do("key", lambda: "ok"), "ok")
+        self.assertEqual(flight.stats()["calls"], 2)
+
+    def test_keys_are_independent(self):
+        flight = SingleFlight()
+
+        self.assertEqual(flight.do("a", lambda: 1), 1)
+        self.assertEqual(flight.do("b", lambda: 2), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
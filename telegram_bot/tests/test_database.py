@@ -0,0 +1,120 @@
+import time
+import unittest
+
+from unittest import mock
+
+from core import database as db
+from tests import DatabaseTestCase
+
+UPSERT = """
+INSERT INTO callback_token (token, data, expires) VALUES (:token, :data, 0)
+ON CONFLICT (token) DO UPDATE SET data = excluded.data
+"""
+
+
+def defer(token: str, data: str) -> None:
+    db.execute_deferred(("callback_token", token), UPSERT, {"token": token, "data": data})
+
+
+def stored() -> dict:
+    return dict(db.execute("SELECT token, data FROM callback_token"))
+
+
+class TestFlush(DatabaseTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+
+        self.addCleanup(db.WRITE_BEHIND.update, dict(db.WRITE_BEHIND))
+
+        # Flushed by the tests only
+        db.WRITE_BEHIND.update({"INTERVAL": 3600, "BATCH_SIZE": 1000})
+        db.start_write_behind()
+        self.addCleanup(db.stop_write_behind)
+
+    def test_writes_are_merged_per_key(self):
+        before = db.write_behind_stats()
+
+        defer("a", "1")
+        defer("a", "2")
+        defer("b", "3")
+
+        self.assertEqual(stored(), {})
+        self.assertEqual(db.get_deferred(("callback_token", "a"))["data"], "2")
+
+        self.assertEqual(db.flush(), 2)
+        self.assertEqual(stored(), {"a": "2", "b": "3"})
+        self.assertIsNone(db.get_deferred(("callback_token", "a")))
+
+        after = db.write_behind_stats()
+        self.assertEqual(
+            [after[k] - before[k] for k in ("deferred", "merged", "flushed")], [3, 1, 2])
+
+    def test_flush_without_writes(self):
+        self.assertEqual(db.flush(), 0)
+
+    def test_failed_flush_keeps_writes(self):
+        defer("a", "1")
+        db.execute_deferred(("bad", 1), "INSERT INTO missing_table VALUES (:x)", {"x": 1})
+
+        with self.assertRaises(db.sqlite3.OperationalError):
+            db.flush()
+
+        # Rolled back as a whole, still pending
+        self.assertEqual(stored(), {})
+        self.assertEqual(db.write_behind_stats()["pending"], 2)
+        self.assertEqual(db.get_deferred(("callback_token", "a"))["data"], "1")
+
+        with self.assertLogs("core.database", "ERROR"):
+            self.assertEqual(db._drop_pending("by the test"), 2)
+
+    def test_newer_write_wins_over_failed_flush(self):
+        defer("a", "old")
+
+        def execute(sql, format):
+            # Arrives while the batch is being committed
+            defer("a", "new")
+            raise db.sqlite3.OperationalError("database is locked")
+
+        with mock.patch.object(db, "transaction") as transaction:
+            transaction.return_value.__enter__.return_value.execute.side_effect = execute
+
+            with self.assertRaises(db.sqlite3.OperationalError):
+                db.flush()
+
+        self.assertEqual(db.get_deferred(("callback_token", "a"))["data"], "new")
+
+        db.flush()
+        self.assertEqual(stored(), {"a": "new"})
+
+    def test_repeated_failures_drop_writes(self):
+        before = db.write_behind_stats()
+
+        db.execute_deferred(("bad", 1), "INSERT INTO missing_table VALUES (:x)", {"x": 1})
+        db.WRITE_BEHIND.update({"INTERVAL": 0.001, "MAX_BACKOFF": 0.01, "MAX_RETRIES": 3})
+
+        with self.assertLogs("core.database", "WARNING") as logs:
+            db._flush_wakeup.set()
+
+            deadline = time.monotonic() + 5
+            while db.write_behind_stats()["dropped"] == before["dropped"] and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        after = db.write_behind_stats()
+
+        self.assertEqual((after["dropped"] - before["dropped"], after["pending"]), (1, 0))
+        self.assertGreaterEqual(after["failures"] - before["failures"], 3)
+        self.assertIn("Dropped 1 deferred writes", "\n".join(logs.output))
+
+
+class TestExecuteDeferred(DatabaseTestCase):
+
+    def test_executed_immediately_without_write_behind(self):
+        defer("a", "1")
+
+        self.assertEqual(stored(), {"a": "1"})
+        self.assertIsNone(db.get_deferred(("callback_token", "a")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+
+from concurrent.futures import Future
+
+from core import database as db
+from core import server
+from tests import DatabaseTestCase
+from utils.server.dedup import RecentUpdates
+
+
+def stored_ids() -> list[int]:
+    return [i for (i,) in db.execute("SELECT update_id FROM processed_update ORDER BY update_id")]
+
+
+class TestRecentUpdates(unittest.TestCase):
+
+    def test_duplicate_is_dropped(self):
+        recent = RecentUpdates(10)
+
+        self.assertTrue(recent.add(1))
+        self.assertFalse(recent.add(1))
+        self.assertEqual(recent.stats()["duplicates"], 1)
+
+    def test_oldest_id_is_evicted(self):
+        recent = RecentUpdates(3)
+
+        for update_id in range(1, 5):
+            self.assertTrue(recent.add(update_id))
+
+        self.assertEqual(recent.stats()["size"], 3)
+        self.assertTrue(recent.add(1))
+        self.assertFalse(recent.add(4))
+
+    def test_discarded_id_is_accepted_again(self):
+        recent = RecentUpdates(10)
+
+        recent.add(1)
+        recent.discard(1)
+
+        self.assertTrue(recent.add(1))
+
+    def test_capacity_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            RecentUpdates(0)
+
+
+class TestPersistedRecentUpdates(DatabaseTestCase):
+
+    def test_only_processed_ids_are_stored(self):
+        recent = RecentUpdates(10, persist=True)
+
+        recent.add(1)
+        recent.add(2)
+        self.assertEqual(stored_ids(), [])
+
+        recent.processed(1)
+        self.assertEqual(stored_ids(), [1])
+
+    def test_restart_drops_processed_and_accepts_unprocessed(self):
+        recent = RecentUpdates(10, persist=True)
+
+        recent.add(1)
+        recent.processed(1)
+        recent.add(2)  # Not handled before the restart
+
+        restarted = RecentUpdates(10, persist=True)
+
+        self.assertFalse(restarted.add(1))
+        self.assertTrue(restarted.add(2))
+
+    def test_prune_keeps_newest_ids(self):
+        recent = RecentUpdates(3, persist=True)
+
+        for update_id in range(1, 6):
+            recent.add(update_id)
+            recent.processed(update_id)
+
+        self.assertEqual(recent.prune(), 2)
+        self.assertEqual(stored_ids(), [3, 4, 5])
+
+    def test_not_persisted(self):
+        recent = RecentUpdates(10)
+
+        recent.add(1)
+        recent.processed(1)
+
+        self.assertEqual(stored_ids(), [])
+
+
+class _Dispatcher:
+    """Holds submitted updates until the test completes them"""
+
+    def __init__(self) -> None:
+        self.futures = []
+
+    def submit(self, key, fn, *args):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+
+class TestDispatchUpdate(DatabaseTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+
+        self.dispatcher = _Dispatcher()
+
+        for name, value in [("DISPATCHER", self.dispatcher), ("RECENT_UPDATES", RecentUpdates(10, persist=True))]:
+            self.addCleanup(setattr, server, name, getattr(server, name))
+            setattr(server, name, value)
+
+    def test_update_id_is_stored_once_handled(self):
+        update = {"update_id": 7, "message": {"chat": {"id": 1}}}
+
+        server.dispatch_update(update)
+        self.assertEqual(stored_ids(), [])
+
+        self.dispatcher.futures[0].set_result(None)
+        self.assertEqual(stored_ids(), [7])
+
+    def test_redelivered_update_is_dropped(self):
+        update = {"update_id": 7, "message": {"chat": {"id": 1}}}
+
+        server.dispatch_update(update)
+        future = server.dispatch_update(update)
+
+        self.assertTrue(future.done())
+        self.assertEqual(len(self.dispatcher.futures), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+
+from core import database as db
+from core import outbox
+from tests import DatabaseTestCase
+from utils.api.methods import SendMessage, TelegramMethods
+from utils.server.workers import WorkerPool
+
+
+class TestOutbox(DatabaseTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+
+        self.addCleanup(outbox.CONFIG.update, dict(outbox.CONFIG))
+        outbox.CONFIG.update({"BATCH_SIZE": 20, "MAX_ATTEMPTS": 3, "RETRY_BACKOFF": 2})
+
+        senders = WorkerPool(2, max_queue=20, name="test-outbox")
+        self.addCleanup(senders.shutdown)
+        self.addCleanup(setattr, outbox, "_senders", outbox._senders)
+        outbox._senders = senders
+
+        self.sent = []
+        self.addCleanup(setattr, outbox, "_send", outbox._send)
+        outbox._send = self.fake_send
+
+    def fake_send(self, row):
+        """Sends succeed unless the text asks otherwise"""
+
+        id, method, params, file_field, file_data, attempts = row
+        text = db.execute("SELECT params FROM outbox WHERE id = ?", (id,))[0][0]
+
+        if "raise" in text:
+            raise RuntimeError("unexpected")
+
+        self.sent.append(id)
+        status = 500 if "fail" in text else 400 if "bad" in text else 200
+
+        return id, attempts, status, "response"
+
+    def rows(self) -> list[tuple]:
+        return db.execute("SELECT id, status, attempts FROM outbox ORDER BY id")
+
+    def test_one_message_per_chat_per_batch(self):
+        first = outbox.enqueue(SendMessage(1, "a"))
+        second = outbox.enqueue(SendMessage(1, "b"))
+        other = outbox.enqueue(SendMessage(2, "c"))
+
+        self.assertEqual(outbox.drain(), 2)
+        self.assertEqual(sorted(self.sent), [first, other])
+
+        self.assertEqual(outbox.drain(), 1)
+        self.assertEqual(self.sent[-1], second)
+        self.assertEqual(self.rows(), [])
+
+    def test_messages_without_chat_are_not_serialized(self):
+        ids = [outbox.enqueue(TelegramMethods("getMe")) for _ in range(3)]
+
+        self.assertEqual(db.execute("SELECT DISTINCT chat_id FROM outbox"), [(None,)])
+        self.assertEqual(outbox.drain(), 3)
+        self.assertEqual(sorted(self.sent), ids)
+
+    def test_failed_message_is_retried_then_dead_lettered(self):
+        id = outbox.enqueue(SendMessage(1, "fail"))
+
+        outbox.drain()
+        self.assertEqual(self.rows(), [(id, "pending", 1)])
+
+        # Not due before its backoff
+        self.assertEqual(outbox.drain(), 0)
+
+        with self.assertLogs("core.outbox", "WARNING"):
+            for _ in range(2):
+                db.execute_and_commit("UPDATE outbox SET next_attempt = 0")
+                outbox.drain()
+
+        self.assertEqual(self.rows(), [(id, "dead", 3)])
+
+    def test_rejected_message_is_dead_lettered(self):
+        id = outbox.enqueue(SendMessage(1, "bad"))
+
+        with self.assertLogs("core.outbox", "WARNING"):
+            outbox.drain()
+
+        self.assertEqual(self.rows(), [(id, "dead", 1)])
+
+    def test_unexpected_error_keeps_sent_results(self):
+        sent = outbox.enqueue(SendMessage(1, "a"))
+        broken = outbox.enqueue(SendMessage(2, "raise"))
+
+        with self.assertLogs(level="WARNING") as logs:
+            self.assertEqual(outbox.drain(), 2)
+
+        self.assertIn("RuntimeError: unexpected", "\n".join(logs.output))
+
+        # The sent message is not sent again, the broken one is retried
+        self.assertEqual(self.rows(), [(broken, "pending", 1)])
+        self.assertEqual(self.sent, [sent])
+
+    def test_complete(self):
+        ids = [outbox.enqueue(SendMessage(chat_id, "x")) for chat_id in range(4)]
+
+        with self.assertLogs("core.outbox", "WARNING"):
+            outbox._complete([
+                (ids[0], 0, 200, "ok"),
+                (ids[1], 0, 403, "blocked"),
+                (ids[2], 0, 429, "too many requests"),
+                (ids[3], 2, None, "timeout"),
+            ])
+
+        self.assertEqual(self.rows(), [
+            (ids[1], "dead", 1),
+            (ids[2], "pending", 1),
+            (ids[3], "dead", 3),
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
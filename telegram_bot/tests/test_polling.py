@@ -0,0 +1,123 @@
+import unittest
+
+from concurrent.futures import Future
+
+import requests
+
+from utils.server.polling import UpdatePoller
+from utils.server.workers import PoolFullErr
+
+
+def done_future() -> Future:
+    future = Future()
+    future.set_result(None)
+    return future
+
+
+class TestProcessBatch(unittest.TestCase):
+
+    def make_poller(self, dispatch, batches) -> UpdatePoller:
+        poller = UpdatePoller("token", dispatch)
+        batches = iter(batches)
+        poller._get_updates = lambda timeout, limit: next(batches)
+        return poller
+
+    def test_offset_follows_last_update(self):
+        dispatched = []
+
+        def dispatch(update):
+            dispatched.append(update["update_id"])
+            return done_future()
+
+        poller = self.make_poller(
+            dispatch, [[{"update_id": 10}, {"update_id": 11}], []])
+
+        self.assertEqual(poller.poll_once(), 2)
+        self.assertEqual(poller.offset, 12)
+        self.assertEqual(dispatched, [10, 11])
+
+        # An empty batch keeps the offset
+        self.assertEqual(poller.poll_once(), 0)
+        self.assertEqual(poller.offset, 12)
+
+    def test_malformed_update_is_skipped(self):
+        dispatched = []
+
+        def dispatch(update):
+            if "message" not in update:
+                raise KeyError("message")
+
+            dispatched.append(update["update_id"])
+            return done_future()
+
+        poller = self.make_poller(dispatch, [[
+            {"update_id": 1, "message": {}},
+            {"update_id": 2},
+            "not an update",
+            {"update_id": 3, "message": {}},
+        ]])
+
+        with self.assertLogs("utils.server.polling", "ERROR"):
+            poller.poll_once()
+
+        self.assertEqual(dispatched, [1, 3])
+        self.assertEqual(poller.offset, 4)
+        self.assertEqual(poller.stats()["errors"], 2)
+
+    def test_offset_advances_when_batch_fails(self):
+
+        def dispatch(update):
+            raise RuntimeError("worker pool stopped")
+
+        poller = self.make_poller(dispatch, [[{"update_id": 5}]])
+
+        with self.assertLogs("utils.server.polling", "ERROR"):
+            poller.poll_once()
+
+        self.assertEqual(poller.offset, 6)
+
+    def test_full_pool_is_retried(self):
+        attempts = []
+
+        def dispatch(update):
+            attempts.append(update["update_id"])
+
+            if len(attempts) == 1:
+                raise PoolFullErr("full")
+
+            return done_future()
+
+        poller = self.make_poller(dispatch, [[{"update_id": 1}]])
+        poller.poll_once()
+
+        self.assertEqual(attempts, [1, 1])
+        self.assertEqual(poller.offset, 2)
+
+
+class TestRun(unittest.TestCase):
+
+    def test_errors_back_off_until_stopped(self):
+        poller = UpdatePoller("token", lambda update: done_future())
+        waits = []
+
+        def get_updates(timeout, limit):
+            if len(waits) == 0:
+                raise requests.ConnectionError("down")
+            if len(waits) == 1:
+                raise ValueError("not json")
+
+            poller.stop()
+            return []
+
+        poller._get_updates = get_updates
+        poller._stop.wait = lambda timeout: waits.append(timeout)
+
+        with self.assertLogs("utils.server.polling", "WARNING"):
+            poller.run()
+
+        self.assertEqual(waits, [1, 2])
+        self.assertEqual(poller.stats()["errors"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
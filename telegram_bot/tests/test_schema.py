@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from unittest import mock
+
+from core import database as db
+from core import schema
+from tests import DatabaseTestCase
+
+
+def tables() -> set[str]:
+    return {name for (name,) in db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")}
+
+
+class TestMigrate(DatabaseTestCase):
+
+    def test_empty_database_is_migrated_to_latest(self):
+        self.assertEqual(schema.get_version(), schema.LATEST_VERSION)
+        self.assertTrue({
+            "usercommandstate", "shortcut", "outbox", "processed_update", "callback_token"
+        } <= tables())
+
+        # Only kept on files that have it, nothing to migrate from here
+        self.assertNotIn("shortcuts", tables())
+
+    def test_migrate_again_does_nothing(self):
+        self.assertEqual(schema.migrate(), 0)
+
+    def test_newer_database_is_refused(self):
+        db.execute_and_commit(f"PRAGMA user_version = {schema.LATEST_VERSION + 1}")
+
+        with self.assertRaises(sqlite3.OperationalError):
+            schema.migrate()
+
+    def test_incremental_vacuum_is_enabled_once(self):
+        self.assertTrue(schema.enable_incremental_vacuum())
+        self.assertFalse(schema.enable_incremental_vacuum())
+        self.assertEqual(db.execute("PRAGMA auto_vacuum")[0][0], 2)
+
+
+class TestLegacyDatabase(unittest.TestCase):
+    """Database created before versioning (version 0)"""
+
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        path = os.path.join(tmp.name, "legacy.db")
+
+        # Original users.db: no unique index on the session chat
+        conn = sqlite3.connect(path)
+        conn.executescript(
+            """
+            CREATE TABLE usercommandstate (user_id INT, chat_id INT, last_command TEXT, require_follow_up BOOL);
+            CREATE TABLE shortcuts (user_id INTEGER PRIMARY KEY, command_list TEXT);
+            INSERT INTO usercommandstate VALUES (1, 1, '/old', 0), (1, 1, '/new', 1), (2, 2, '/other', 0);
+            INSERT INTO shortcuts VALUES (1, '[{"a": "/weather"}]');
+            """
+        )
+        conn.close()
+
+        db.connect(path)
+        self.addCleanup(db.disconnect)
+
+    def test_data_is_kept(self):
+        self.assertEqual(schema.migrate(), schema.LATEST_VERSION)
+
+        self.assertEqual(
+            db.execute("SELECT user_id, last_command FROM usercommandstate ORDER BY user_id"),
+            [(1, "/new"), (2, "/other")])
+        self.assertEqual(db.execute("SELECT COUNT(*) FROM shortcuts"), [(1,)])
+
+    def test_session_upsert_works(self):
+        schema.migrate()
+
+        db.execute_and_commit(
+            """
+            INSERT INTO usercommandstate (user_id, chat_id, last_command, require_follow_up, updated_at)
+            VALUES (1, 1, '/upsert', 0, 0)
+            ON CONFLICT (user_id, chat_id) DO UPDATE SET last_command = excluded.last_command
+            """
+        )
+
+        self.assertEqual(
+            db.execute("SELECT last_command FROM usercommandstate WHERE user_id = 1"), [("/upsert",)])
+
+    def test_failed_migration_keeps_last_version(self):
+        failing = schema.MIGRATIONS[2]
+
+        def fail(cur):
+            failing(cur)
+            raise sqlite3.OperationalError("disk full")
+
+        with mock.patch.object(schema, "MIGRATIONS", [*schema.MIGRATIONS[:2], fail, *schema.MIGRATIONS[3:]]):
+            with self.assertRaises(sqlite3.OperationalError):
+                schema.migrate()
+
+        self.assertEqual(schema.get_version(), 2)
+        self.assertNotIn("shortcut", tables())
+
+        schema.migrate()
+        self.assertEqual(schema.get_version(), schema.LATEST_VERSION)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import json
+import unittest
+import urllib.error
+import urllib.request
+
+from unittest import mock
+
+from core import server
+
+
+class TestStatsServer(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.addCleanup(setattr, server, "CONFIG", server.CONFIG)
+        server.CONFIG = {"STATS": {"ENABLED": True, "HOST": "127.0.0.1", "PORT": 0}}
+
+        patcher = mock.patch.object(server, "get_stats", return_value={"workers": None})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.stats_server = server.start_stats_server()
+        self.addCleanup(self.stats_server.server_close)
+        self.addCleanup(self.stats_server.shutdown)
+
+        host, port = self.stats_server.server_address[:2]
+        self.url = f"http://{host}:{port}"
+
+    def test_stats_are_served_on_localhost(self):
+        self.assertEqual(self.stats_server.server_address[0], "127.0.0.1")
+
+        with urllib.request.urlopen(self.url + "/stats", timeout=5) as res:
+            self.assertEqual(res.headers["Content-Type"], "application/json")
+            self.assertEqual(json.load(res), {"workers": None})
+
+    def test_other_paths_are_not_found(self):
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(self.url + "/", timeout=5)
+
+        self.assertEqual(e.exception.code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
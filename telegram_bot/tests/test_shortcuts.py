@@ -0,0 +1,130 @@
+import json
+import os
+import sqlite3
+import threading
+import unittest
+
+from unittest import mock
+
+from core import database as db
+from modules.shortcuts import Shortcuts
+from tests import DatabaseTestCase
+
+
+def shortcut_rows() -> list[tuple]:
+    return db.execute("SELECT user_id, position, name, command FROM shortcut ORDER BY user_id, position")
+
+
+def blob_users() -> list[int]:
+    return [user_id for (user_id,) in db.execute("SELECT user_id FROM shortcuts ORDER BY user_id")]
+
+
+class TestBlobMigration(DatabaseTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+
+        patcher = mock.patch.object(Shortcuts, "_blobs_migrated", threading.Event())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.config_path = os.path.join(self._tmp.name, "config.json")
+
+        with open(self.config_path, "w") as f:
+            json.dump({}, f)
+
+        # Legacy table of the original users.db, one JSON list per user
+        db.execute_and_commit("CREATE TABLE IF NOT EXISTS shortcuts (user_id INTEGER PRIMARY KEY, command_list TEXT)")
+
+        with db.transaction() as cur:
+            cur.executemany("INSERT INTO shortcuts VALUES (?, ?)", [
+                (1, json.dumps([{"rain": "/weather rainmap"}, {"4d": "/weather forecast4d"}])),
+                (2, json.dumps([{"hi": "hello"}])),
+            ])
+
+    def migrate(self) -> None:
+        """Run setup() and wait for the migration thread"""
+
+        Shortcuts.setup(self.config_path)
+        self.assertTrue(Shortcuts._blobs_migrated.wait(5))
+
+    def test_blobs_are_moved_to_rows(self):
+        self.migrate()
+
+        self.assertEqual(shortcut_rows(), [
+            (1, 0, "rain", "/weather rainmap"),
+            (1, 1, "4d", "/weather forecast4d"),
+            (2, 0, "hi", "hello"),
+        ])
+        self.assertEqual(blob_users(), [])
+
+    def test_blob_is_appended_after_existing_shortcuts(self):
+        db.execute_and_commit("INSERT INTO shortcut VALUES (1, 0, 'new', '/new')")
+
+        self.migrate()
+
+        self.assertEqual(
+            [row[1:3] for row in shortcut_rows() if row[0] == 1],
+            [(0, "new"), (1, "rain"), (2, "4d")])
+
+    def test_user_is_migrated_inline_before_the_thread(self):
+        rows, has_prev, has_next = Shortcuts(1, 1)._db_get()
+
+        self.assertEqual(rows, [(0, "rain", "/weather rainmap"), (1, "4d", "/weather forecast4d")])
+        self.assertEqual(blob_users(), [2])
+
+        # Nothing is left for the thread to move for this user
+        self.migrate()
+        self.assertEqual(len(shortcut_rows()), 3)
+
+    def test_failed_pass_is_retried_on_next_start(self):
+        migrate_user = Shortcuts._migrate_user
+
+        def fail_second_user(user_id):
+            if user_id == 2:
+                raise sqlite3.OperationalError("database is locked")
+
+            migrate_user(user_id)
+
+        with mock.patch.object(Shortcuts, "_migrate_user", side_effect=fail_second_user):
+            with self.assertLogs("modules.shortcuts", "ERROR"):
+                Shortcuts._migrate_blobs()
+
+        self.assertEqual(blob_users(), [2])
+        self.assertEqual(len(shortcut_rows()), 2)
+
+        Shortcuts._blobs_migrated.clear()
+        self.migrate()
+
+        self.assertEqual(blob_users(), [])
+        self.assertEqual(len(shortcut_rows()), 3)
+
+    def test_second_run_does_nothing(self):
+        self.migrate()
+        rows = shortcut_rows()
+
+        Shortcuts._blobs_migrated.clear()
+        self.migrate()
+        Shortcuts._migrate_user(1)
+
+        self.assertEqual(shortcut_rows(), rows)
+
+
+class TestNewDatabase(DatabaseTestCase):
+
+    def test_no_migration_without_legacy_table(self):
+        config_path = os.path.join(self._tmp.name, "config.json")
+
+        with open(config_path, "w") as f:
+            json.dump({}, f)
+
+        with mock.patch.object(Shortcuts, "_blobs_migrated", threading.Event()), \
+                mock.patch("modules.shortcuts.threading.Thread") as thread:
+            Shortcuts.setup(config_path)
+
+            self.assertTrue(Shortcuts._blobs_migrated.is_set())
+            thread.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from unittest import mock
+
+import requests
+
+from modules.weather import Weather
+
+URL = "https://api.example.com/v1/forecast?key=secret"
+
+
+class TestUpstreamErrors(unittest.TestCase):
+
+    def assertApiError(self, replies, sub_mod_name):
+        self.assertEqual(len(replies), 1)
+        self.assertEqual(replies[0].text, f"[{Weather.hook} {sub_mod_name}]:\nAPI Error, Please try again later")
+        self.assertNotIn(URL, replies[0].text)
+
+    def test_forecast4d_connection_error(self):
+        error = requests.ConnectionError(f"Max retries exceeded with url: {URL}")
+
+        with mock.patch.object(Weather, "_fetch_forecast4d_api", side_effect=error):
+            self.assertApiError(Weather._weather_forecast4d_reply(1, Weather.hook, "forecast4d"), "forecast4d")
+
+    def test_rainmap_timeout(self):
+        error = requests.Timeout(f"Read timed out: {URL}")
+
+        with mock.patch.object(Weather._prefetcher, "is_running", return_value=False), \
+                mock.patch.object(Weather, "_fetch_rainmap_api", side_effect=error):
+            self.assertApiError(Weather._weather_rainmap_reply(1, Weather.hook, "rainmap"), "rainmap")
+
+
+if __name__ == "__main__":
+    unittest.main()
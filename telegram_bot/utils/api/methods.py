@@ -1,5 +1,7 @@
 """
-Wrappers/Callable Classes for request.post() to telegrams servers.
+Wrappers/Callable Classes for posting to telegrams servers.
+
+Calls are made through the shared pooled client in core.client.
 
 More Infomation: https://core.telegram.org/bots/api/#available-methods
 
@@ -7,8 +9,8 @@ More Infomation: https://core.telegram.org/bots/api/#available-methods
 
 import dataclasses
 from typing import Optional, Union
-import requests
 
+from core import client
 from utils.api.objects import TelegramObject, InlineKeyboardMarkup
 
 
@@ -18,14 +20,17 @@ class TelegramMethods:
     
     Attributes:
     methods: name of telegram methods 
+    inline_reply: method can be sent as the body of a webhook response
     """
 
+    inline_reply = True
+
     def __init__(self, method: str, **kwargs) -> None:
         self.method = method
         self.__dict__.update(kwargs)
 
     def __call__(self, *args, **kwargs):
-        return self.post(*args, *kwargs)
+        return self.post(*args, **kwargs)
 
     def post_url(self, token: str):
         return f'https://api.telegram.org/bot{token}/{self.method}'
@@ -46,12 +51,31 @@ class TelegramMethods:
 
         return response_dict
 
+    def webhook_dict(self) -> dict:
+        """Method and parameters as sent in the body of a webhook response"""
+
+        webhook_dict = {"method": self.method}
+
+        for name, value in vars(self).items():
+            if name.startswith('__') or name == 'method' or value is None:
+                continue
+
+            if isinstance(value, TelegramObject):
+                webhook_dict[name] = value.to_dict()
+            else:
+                webhook_dict[name] = value
+
+        return webhook_dict
+
+    def request_parts(self) -> tuple[dict, Optional[dict]]:
+        """Parameters and files to upload of the request"""
+
+        return self.response_dict(), None
+
     def post(self, token, raise_errors=False):
 
-        r = requests.post(
-            url=self.post_url(token),
-            params=self.response_dict()
-        )
+        params, files = self.request_parts()
+        r = client.post(token, self.method, params=params, files=files)
 
         if raise_errors == True:
             r.raise_for_status()
@@ -74,8 +98,7 @@ class SendMessage(TelegramMethods):
     reply_to_message_id: Optional[str] = None
     allow_sending_without_reply: Optional[bool] = None
 
-    def post_url(self, token: str):
-        return f'https://api.telegram.org/bot{token}/sendMessage'
+    method = "sendMessage"
 
 
 @dataclasses.dataclass
@@ -93,20 +116,31 @@ class SendPhoto(TelegramMethods):
     reply_to_message_id: Optional[str] = None
     allow_sending_without_reply: Optional[bool] = None
 
-    def post_url(self, token: str):
-        return f'https://api.telegram.org/bot{token}/sendPhoto'
+    method = "sendPhoto"
+    inline_reply = False  # File uploads cannot be sent in a webhook response
 
-    def post(self, token, raise_errors=False):
+    def request_parts(self) -> tuple[dict, Optional[dict]]:
         params = self.response_dict()
         photo = params.pop('photo')
 
-        r = requests.post(
-            url=self.post_url(token),
-            params=params,
-            files={'photo': photo}
-        )
+        return params, {'photo': photo}
 
-        if raise_errors == True:
-            r.raise_for_status()
 
-        return r.status_code
+@dataclasses.dataclass
+class AnswerCallbackQuery(TelegramMethods):
+    """
+    Answer to a pressed inline keyboard button.
+
+    Modules may return one with their replies to show a notification or
+    alert, callback_query_id is filled in by the server when left empty.
+    """
+
+    callback_query_id: Optional[str] = None
+
+    _: dataclasses.KW_ONLY
+    text: Optional[str] = None
+    show_alert: Optional[bool] = None
+    url: Optional[str] = None
+    cache_time: Optional[int] = None
+
+    method = "answerCallbackQuery"
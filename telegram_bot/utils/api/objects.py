@@ -4,7 +4,7 @@ This module contains dataclasses for object returned/used by the telegram bot ap
 Objects can be be found in "Available types" section in: https://core.telegram.org/bots/api
 """
 
-from typing import Optional
+from typing import Callable, Optional
 
 from utils.exceptions import *
 from dataclasses import field, dataclass, KW_ONLY
@@ -192,10 +192,21 @@ class InlineKeyboardMarkup(TelegramObject):
     _: KW_ONLY
     inline_keyboard: list = field(init=False, default_factory=list)
 
+    # Maps the data of a button to the callback_data sent, see set_data_encoder()
+    _encode_data = None
+
     def __init__(self, labels, callback_data) -> None:
         self.inline_keyboard = InlineKeyboardMarkup._build(
             labels, callback_data)
 
+    @classmethod
+    def set_data_encoder(cls, encoder: Optional[Callable[[str], str]]) -> None:
+        """
+        Set the function applied to the data of every button, e.g. to send
+        long data as a token. None sends the data as is.
+        """
+        cls._encode_data = encoder
+
     @staticmethod
     def _build(labels:list[list[str]], data:list[list[str]]) -> list:
         
@@ -210,10 +221,17 @@ class InlineKeyboardMarkup(TelegramObject):
                         {"text": str(labels[i][j]), "callback_data": str(data[i][j])})
 
                 inline_keyboard.append(tmp)
-            
-            return inline_keyboard
         
         except Exception as e:
             raise TypeError(f"Invaild parameters types. Ensure that 1) list is 2D, 2) labels and data have the same shape. " + str(e))
 
+        encode = InlineKeyboardMarkup._encode_data
+
+        if encode is not None:
+            for row in inline_keyboard:
+                for button in row:
+                    button["callback_data"] = encode(button["callback_data"])
+
+        return inline_keyboard
+
 
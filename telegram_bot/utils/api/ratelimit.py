@@ -0,0 +1,226 @@
+"""
+Token bucket rate limiting of messages sent to telegram.
+
+Telegram limits bots to about 30 messages per second overall, 1 message per
+second in a chat and 20 messages per minute in a group. A message must take
+a token from the global bucket, the bucket of its chat and, for groups, the
+bucket of the group before it is sent.
+
+More Infomation: https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+
+    Typical usage example:
+
+    limiter = RateLimiter()
+    limiter.acquire(chat_id)  # blocks until the message may be sent
+    limiter.retry_after(chat_id, 5)  # after a 429 response
+
+"""
+import threading
+import time
+
+from typing import Union
+
+
+class TokenBucket:
+    """
+    Bucket refilled with `rate` tokens per second up to `capacity`
+
+    Attributes:
+        rate: tokens added per second
+        capacity: max tokens held, the allowed burst
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available"""
+
+        self._refill(now)
+
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        if self.tokens >= 1:
+            return 0.0
+
+        return (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        self.tokens -= 1
+
+    def block(self, until: float) -> None:
+        """Hold back all tokens until the given time"""
+
+        self.blocked_until = max(self.blocked_until, until)
+        self.tokens = min(self.tokens, 0)
+
+    def is_idle(self, now: float) -> bool:
+        """Bucket is full again and can be dropped"""
+
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class RateLimiter:
+    """
+    Global, per chat and per group token buckets
+
+    Attributes:
+        global_rate, global_burst: limit of all messages
+        chat_rate, chat_burst: limit of messages to a chat
+        group_rate, group_burst: limit of messages to a group
+    """
+
+    # Drop idle chat buckets every `prune_interval` seconds
+    prune_interval = 60
+
+    def __init__(self, global_rate: float = 30, global_burst: float = 30,
+                 chat_rate: float = 1, chat_burst: float = 3,
+                 group_rate: float = 20 / 60, group_burst: float = 20) -> None:
+
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+
+        now = time.monotonic()
+
+        self._lock = threading.Lock()
+        self._global = TokenBucket(global_rate, global_burst, now)
+        self._chats: dict[Union[int, str], TokenBucket] = {}
+        self._groups: dict[Union[int, str], TokenBucket] = {}
+        self._pruned = now
+
+        self._sent = 0
+        self._delayed = 0
+        self._delay_time = 0.0
+        self._throttled = 0
+
+    @staticmethod
+    def is_group(chat_id: Union[int, str]) -> bool:
+        """Groups and channels have negative ids or @usernames"""
+
+        try:
+            return int(chat_id) < 0
+        except ValueError:
+            return True
+
+    def _buckets(self, chat_id, now: float) -> list[TokenBucket]:
+
+        buckets = [self._global]
+
+        if chat_id is None:
+            return buckets
+
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(
+                self.chat_rate, self.chat_burst, now)
+        buckets.append(bucket)
+
+        if self.is_group(chat_id):
+            bucket = self._groups.get(chat_id)
+            if bucket is None:
+                bucket = self._groups[chat_id] = TokenBucket(
+                    self.group_rate, self.group_burst, now)
+            buckets.append(bucket)
+
+        return buckets
+
+    def _prune(self, now: float) -> None:
+
+        for buckets in (self._chats, self._groups):
+            for key in [k for k, b in buckets.items() if b.is_idle(now)]:
+                del buckets[key]
+
+        self._pruned = now
+
+    def acquire(self, chat_id: Union[int, str] = None) -> float:
+        """
+        Wait until a message to the chat may be sent and take its tokens
+
+        Args:
+            chat_id (optional): chat the message is sent to
+
+        Returns:
+            seconds waited
+        """
+
+        waited = 0.0
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+
+                if now - self._pruned > self.prune_interval:
+                    self._prune(now)
+
+                buckets = self._buckets(chat_id, now)
+                delay = max(b.delay(now) for b in buckets)
+
+                if delay <= 0:
+                    for b in buckets:
+                        b.consume()
+
+                    self._sent += 1
+
+                    if waited > 0:
+                        self._delayed += 1
+                        self._delay_time += waited
+
+                    return waited
+
+            time.sleep(delay)
+            waited += delay
+
+    def retry_after(self, chat_id: Union[int, str], seconds: float) -> None:
+        """
+        Hold back messages after telegram responded with 429
+
+        Args:
+            chat_id: chat of the throttled message, None for all chats
+            seconds: retry_after value of the response
+        """
+
+        with self._lock:
+            now = time.monotonic()
+
+            if chat_id is None:
+                buckets = [self._global]
+            else:
+                buckets = self._buckets(chat_id, now)[1:]
+
+            for b in buckets:
+                b.block(now + seconds)
+
+            self._throttled += 1
+
+    def stats(self) -> dict:
+        """
+        Get counters of the limiter
+
+        Returns:
+            dict of sent, delayed and throttled messages
+        """
+
+        with self._lock:
+            return {
+                "sent": self._sent,
+                "delayed": self._delayed,
+                "delay_time": round(self._delay_time, 3),
+                "throttled": self._throttled,
+                "chats": len(self._chats),
+                "groups": len(self._groups),
+            }
@@ -0,0 +1,210 @@
+"""
+Bounded in-memory cache with LRU eviction and TTL expiry, and collapsing of
+concurrent calls loading the same key.
+
+    Typical usage example:
+
+    cache = LRUCache(maxsize=1000, ttl=300)
+    cache.set(key, value)
+    value = cache.get(key)  # None once evicted or expired
+
+    flight = SingleFlight()
+    value = flight.do(key, load, key)  # one load() for concurrent callers
+
+"""
+import time
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    """
+    Thread safe LRU cache whose entries expire `ttl` seconds after being set
+
+    Attributes:
+        maxsize: max number of entries
+        ttl: seconds an entry is valid for, None to never expire
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key: Hashable, default=None):
+        """
+        Get a value and mark it as recently used
+
+        Returns:
+            cached value, default if missing or expired
+        """
+
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is None:
+                self._misses += 1
+                return default
+
+            expires, value = entry
+
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                self._expirations += 1
+                self._misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def peek(self, key: Hashable, default=None):
+        """
+        Get a value without counting a lookup or marking it as used
+
+        Returns:
+            cached value, default if missing or expired
+        """
+
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is None or (entry[0] is not None and entry[0] <= time.monotonic()):
+                return default
+
+            return entry[1]
+
+    def set(self, key: Hashable, value, ttl: float = None) -> None:
+        """
+        Set a value, evicting the least recently used entry if full
+
+        Args:
+            key: key of the entry
+            value: value to cache
+            ttl (optional): seconds the entry is valid for, defaults to self.ttl
+        """
+
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        """Remove an entry if present"""
+
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all entries"""
+
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """
+        Get counters of the cache
+
+        Returns:
+            dict of hit/miss/eviction counters
+        """
+
+        with self._lock:
+            lookups = self._hits + self._misses
+
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 3) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+
+class SingleFlight:
+    """
+    Run a call once for all threads asking for the same key at the same time
+
+    Threads calling do() while a call of the key is running wait for it and
+    get its result (or exception) instead of calling again.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+        self._calls_made = 0
+        self._shared = 0
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        """
+        Call fn(*args, **kwargs), or wait for the running call of the key
+
+        Returns:
+            result of the call
+
+        Raises:
+            Exception: raised by the call
+        """
+
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+
+            if leader:
+                future = self._calls[key] = Future()
+                self._calls_made += 1
+            else:
+                self._shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self) -> dict:
+        """
+        Get counters of the calls
+
+        Returns:
+            dict of calls made and calls that waited for a running call
+        """
+
+        with self._lock:
+            return {
+                "calls": self._calls_made,
+                "shared": self._shared,
+                "in_flight": len(self._calls),
+            }
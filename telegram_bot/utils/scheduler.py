@@ -0,0 +1,202 @@
+"""
+Background scheduler of periodic jobs.
+
+Jobs run one at a time on a single daemon thread. A job runs again
+`interval` seconds (± `jitter`) after it finished; a failed job is retried
+after `retry` seconds, doubling after each failure up to `interval`.
+
+    Typical usage example:
+
+    scheduler = Scheduler("prefetch")
+    scheduler.add("forecast", refresh_forecast, interval=1800, jitter=0.1)
+    scheduler.start()
+    scheduler.stats()  # last run / success / error of each job
+
+"""
+import time
+import heapq
+import random
+import logging
+import threading
+
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """
+    Periodic job and the outcome of its last runs
+
+    Attributes:
+        name: name of the job
+        fn: function run by the job
+        interval: seconds between runs
+        jitter: fraction of interval added or removed at random
+        retry: seconds to wait after the first failure
+    """
+
+    def __init__(self, name: str, fn: Callable[[], None], interval: float, jitter: float = 0.1, retry: float = 30) -> None:
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.jitter = jitter
+        self.retry = min(retry, interval)
+
+        self.runs = 0
+        self.failures = 0  # consecutive failures
+        self.last_run = None
+        self.last_success = None
+        self.last_error = None
+        self.last_duration = None
+        self.next_run = None
+
+    def delay(self) -> float:
+        """Seconds to wait before the next run"""
+
+        if self.failures:
+            return min(self.retry * 2 ** (self.failures - 1), self.interval)
+
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def run(self) -> None:
+
+        start = time.perf_counter()
+        self.last_run = time.time()
+        self.runs += 1
+
+        try:
+            self.fn()
+
+        except Exception as e:
+            self.failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.warning("Job %s failed (%s in a row): %s",
+                           self.name, self.failures, self.last_error)
+
+        else:
+            self.failures = 0
+            self.last_success = self.last_run
+
+        self.last_duration = time.perf_counter() - start
+
+
+class Scheduler:
+    """
+    Runs jobs on a background thread
+
+    Attributes:
+        name: name of the thread
+    """
+
+    def __init__(self, name: str = "scheduler") -> None:
+        self.name = name
+
+        self._jobs: dict[str, Job] = {}
+        self._queue: list[tuple[float, int, str]] = []  # (due, seq, job name)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, name: str, fn: Callable[[], None], interval: float, jitter: float = 0.1, retry: float = 30, delay: float = 0) -> Job:
+        """
+        Add a job
+
+        Args:
+            name: unique name of the job
+            fn: function to run, raises on failure
+            interval: seconds between runs
+            jitter (optional): fraction of interval added or removed at random
+            retry (optional): seconds to wait after the first failure
+            delay (optional): seconds before the first run
+
+        Returns:
+            Job
+        """
+
+        job = Job(name, fn, interval, jitter, retry)
+
+        with self._lock:
+            self._jobs[name] = job
+            self._push(job, delay)
+
+        self._wakeup.set()
+        return job
+
+    def _push(self, job: Job, delay: float) -> None:
+
+        job.next_run = time.time() + delay
+        self._seq += 1
+        heapq.heappush(self._queue, (time.monotonic() + delay, self._seq, job.name))
+
+    def _run(self) -> None:
+
+        while not self._stop.is_set():
+            with self._lock:
+                due, _, name = self._queue[0] if self._queue else (None, None, None)
+                job = None
+
+                if due is not None and due <= time.monotonic():
+                    heapq.heappop(self._queue)
+                    job = self._jobs.get(name)
+
+            if job is None:
+                self._wakeup.wait(
+                    None if due is None else max(0, due - time.monotonic()))
+                self._wakeup.clear()
+                continue
+
+            job.run()
+
+            with self._lock:
+                self._push(job, job.delay())
+
+    def start(self) -> None:
+        """Start the scheduler thread"""
+
+        if self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the scheduler thread, waits for a running job"""
+
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None
+
+    def stats(self) -> dict:
+        """
+        Get the state of each job
+
+        Returns:
+            dict of job name: runs, failures, last run / success / error
+            and next run (unix time)
+        """
+
+        with self._lock:
+            return {
+                name: {
+                    "runs": job.runs,
+                    "failures": job.failures,
+                    "last_run": job.last_run,
+                    "last_success": job.last_success,
+                    "last_error": job.last_error,
+                    "last_duration": round(job.last_duration, 3) if job.last_duration is not None else None,
+                    "next_run": job.next_run,
+                }
+                for name, job in self._jobs.items()
+            }
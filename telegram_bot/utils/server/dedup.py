@@ -0,0 +1,163 @@
+"""
+Index of recently received update ids, used to drop redelivered updates.
+
+Telegram delivers an update again if the webhook response is slow or
+fails. The ids of the last `capacity` updates are kept in a ring buffer and
+optionally in the database so that duplicates are also dropped across
+restarts. An id is only stored once its update has been handled, so an
+update lost in a crash is handled when telegram delivers it again.
+
+    Typical usage example:
+
+    recent = RecentUpdates(10000, persist=True)
+    if recent.add(update_id):
+        ...  # First time this update is seen, handle it
+        recent.processed(update_id)
+
+"""
+import threading
+
+from array import array
+
+from core import database as db
+
+
+class RecentUpdates:
+    """
+    Bounded set of update ids evicting the oldest id first
+
+    Attributes:
+        capacity: number of ids remembered
+        persist: ids of handled updates are stored in the processed_update table
+    """
+
+    def __init__(self, capacity: int = 10000, persist: bool = False) -> None:
+
+        if capacity < 1:
+            raise ValueError("Capacity must be at least 1")
+
+        self.capacity = capacity
+        self.persist = persist
+
+        self._ring = array('q', bytes(8 * capacity))
+        self._slots: dict[int, int] = {}  # update id -> position in ring
+        self._pos = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self._duplicates = 0
+
+        if persist:
+            self._load()
+            db.register_maintenance("processed_update", self.prune)
+
+    def _load(self) -> None:
+        """Fill the ring with the newest stored ids"""
+
+        rows = db.execute(
+            "SELECT update_id FROM processed_update ORDER BY update_id DESC LIMIT ?",
+            (self.capacity,))
+
+        for (update_id,) in reversed(rows):
+            self._insert(update_id)
+
+        self.prune()
+
+    def prune(self) -> int:
+        """
+        Delete stored ids that no longer fit in the ring, run by the
+        database maintenance task
+
+        Returns:
+            number of ids deleted
+        """
+
+        rows = db.execute_and_commit(
+            """
+            DELETE FROM processed_update WHERE update_id < (
+                SELECT update_id FROM processed_update
+                ORDER BY update_id DESC LIMIT 1 OFFSET ?
+            )
+            RETURNING update_id
+            """,
+            (self.capacity - 1,)
+        )
+
+        return len(rows)
+
+    def _insert(self, update_id: int) -> None:
+        """Insert into the ring, evicting the oldest id if full"""
+
+        if self._size == self.capacity:
+            old = self._ring[self._pos]
+
+            if self._slots.get(old) == self._pos:
+                del self._slots[old]
+        else:
+            self._size += 1
+
+        self._ring[self._pos] = update_id
+        self._slots[update_id] = self._pos
+        self._pos = (self._pos + 1) % self.capacity
+
+    def add(self, update_id: int) -> bool:
+        """
+        Remember an update id in memory
+
+        Args:
+            update_id: id of the update
+
+        Returns:
+            True if the id is new, False if it is a duplicate
+        """
+
+        with self._lock:
+            if update_id in self._slots:
+                self._duplicates += 1
+                return False
+
+            self._insert(update_id)
+
+        return True
+
+    def processed(self, update_id: int) -> None:
+        """
+        Store the id of an update that has been handled
+
+        Written through the database write-behind, stored ids are only
+        trimmed by prune().
+
+        Args:
+            update_id: id given to add()
+
+        Raises:
+            sqlite3.Error: Database error (write-behind disabled)
+        """
+
+        if self.persist:
+            db.execute_deferred(
+                ("processed_update", update_id),
+                "INSERT OR IGNORE INTO processed_update VALUES (:update_id)",
+                {"update_id": update_id}
+            )
+
+    def discard(self, update_id: int) -> None:
+        """Forget an update id, used when the update could not be queued"""
+
+        with self._lock:
+            self._slots.pop(update_id, None)
+
+    def stats(self) -> dict:
+        """
+        Get counters of the index
+
+        Returns:
+            dict of remembered ids and duplicates suppressed
+        """
+
+        with self._lock:
+            return {
+                "size": len(self._slots),
+                "capacity": self.capacity,
+                "duplicates": self._duplicates,
+            }
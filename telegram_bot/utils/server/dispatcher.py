@@ -0,0 +1,139 @@
+"""
+Dispatch jobs to a WorkerPool while keeping jobs sharing a key in order.
+
+Jobs are sharded by key (the chat id) into lanes. Each lane is drained by
+at most one worker at a time so that the jobs of a chat are processed in
+arrival order, while different chats are processed in parallel.
+
+    Typical usage example:
+
+    dispatcher = ChatDispatcher(WorkerPool(8), max_lane_size=16)
+    dispatcher.submit(chat_id, handle, update)
+
+"""
+import logging
+import threading
+
+from collections import deque
+from concurrent.futures import Future
+from typing import Hashable
+
+from utils.server.workers import WorkerPool, PoolFullErr
+
+logger = logging.getLogger(__name__)
+
+
+class LaneFullErr(PoolFullErr):
+    """Exception class raised when the backlog of a lane is at capacity"""
+
+    def __init__(self, message="Chat backlog is full", *args: object) -> None:
+        super().__init__(message, *args)
+
+
+class ChatDispatcher:
+    """
+    Ordered per key dispatch on top of a shared WorkerPool
+
+    Attributes:
+        pool: WorkerPool running the lanes
+        max_lane_size: maximum number of jobs waiting in a single lane
+    """
+
+    def __init__(self, pool: WorkerPool, max_lane_size: int = 16) -> None:
+        self.pool = pool
+        self.max_lane_size = max_lane_size
+
+        self._lanes: dict[Hashable, deque] = {}
+        self._lock = threading.Lock()
+
+        self._dispatched = 0
+        self._rejected = 0
+        self._max_lane_depth = 0
+
+    def submit(self, key: Hashable, fn, *args, **kwargs) -> Future:
+        """
+        Queue a job behind the other jobs of the same key
+
+        Args:
+            key: lane key, jobs with the same key are run sequentially
+            fn: callable to run
+            *args, **kwargs: arguments passed to fn
+
+        Returns:
+            concurrent.futures.Future of the job
+
+        Raises:
+            LaneFullErr: The lane of the key is full
+            PoolFullErr: No space in the pool to start a new lane
+        """
+
+        future = Future()
+        job = (future, fn, args, kwargs)
+
+        with self._lock:
+            lane = self._lanes.get(key)
+
+            if lane is not None:
+                if len(lane) >= self.max_lane_size:
+                    self._rejected += 1
+                    raise LaneFullErr
+
+                # The worker draining the lane will pick the job up
+                lane.append(job)
+                self._dispatched += 1
+                self._max_lane_depth = max(self._max_lane_depth, len(lane))
+                return future
+
+            self._lanes[key] = deque([job])
+
+            try:
+                self.pool.submit(self._drain, key)
+
+            except PoolFullErr:
+                del self._lanes[key]
+                self._rejected += 1
+                raise
+
+            self._dispatched += 1
+
+        return future
+
+    def _drain(self, key: Hashable):
+        """Run the jobs of a lane until it is empty"""
+
+        while True:
+            with self._lock:
+                lane = self._lanes[key]
+
+                if not lane:
+                    del self._lanes[key]
+                    return
+
+                future, fn, args, kwargs = lane.popleft()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                logger.exception("Unhandled error in lane %s", key)
+                future.set_exception(e)
+
+    def stats(self) -> dict:
+        """
+        Get counters of the dispatcher
+
+        Returns:
+            dict of lane counters
+        """
+
+        with self._lock:
+            return {
+                "active_lanes": len(self._lanes),
+                "backlog": sum(len(lane) for lane in self._lanes.values()),
+                "max_lane_size": self.max_lane_size,
+                "max_lane_depth": self._max_lane_depth,
+                "dispatched": self._dispatched,
+                "rejected": self._rejected,
+            }
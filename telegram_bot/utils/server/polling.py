@@ -0,0 +1,196 @@
+"""
+Long polling of updates with getUpdates, used in place of a webhook.
+
+Updates are fetched in batches, every update of a batch is dispatched and
+the offset is only advanced once the whole batch has been processed. If the
+process dies while handling a batch, telegram delivers it again.
+
+More Infomation: https://core.telegram.org/bots/api/#getupdates
+
+    Typical usage example:
+
+    poller = UpdatePoller(token, dispatch, limit=100, timeout=30)
+    poller.run()
+
+"""
+import logging
+import threading
+import time
+
+from concurrent.futures import wait, FIRST_COMPLETED
+import requests
+
+from core import client
+from utils.server.workers import PoolFullErr
+
+logger = logging.getLogger(__name__)
+
+
+class UpdatePoller:
+    """
+    Fetch updates in batches and process each batch concurrently
+
+    Attributes:
+        token: telegram bot token
+        dispatch: callable accepting an update dict and returning a Future
+        limit: max number of updates fetched per batch (1-100)
+        timeout: long polling timeout in seconds
+        offset: id of the next update to fetch
+    """
+
+    max_backoff = 60
+
+    def __init__(self, token: str, dispatch, limit: int = 100, timeout: int = 30, allowed_updates=None) -> None:
+        self.token = token
+        self.dispatch = dispatch
+        self.limit = limit
+        self.timeout = timeout
+        self.allowed_updates = allowed_updates
+        self.offset = None
+
+        self._stop = threading.Event()
+
+        self._batches = 0
+        self._updates = 0
+        self._last_batch_size = 0
+        self._max_batch_size = 0
+        self._errors = 0
+
+    def _get_updates(self, timeout: int, limit: int) -> list[dict]:
+        params = {"timeout": timeout, "limit": limit}
+
+        if self.offset is not None:
+            params["offset"] = self.offset
+
+        if self.allowed_updates is not None:
+            params["allowed_updates"] = self.allowed_updates
+
+        r = client.post(
+            self.token,
+            "getUpdates",
+            json=params,
+            timeout=(client.CONFIG["CONNECT_TIMEOUT"], timeout + 10)
+        )
+        r.raise_for_status()
+
+        return r.json()["result"]
+
+    def _process_batch(self, updates: list[dict]) -> None:
+        """
+        Dispatch a batch and wait for all of it to be processed
+
+        Updates that cannot be dispatched (e.g. malformed) are logged and
+        skipped so that they do not block the rest of the batch.
+        """
+
+        pending = []
+
+        for update in updates:
+            while True:
+                try:
+                    pending.append(self.dispatch(update))
+                    break
+
+                except PoolFullErr:
+                    # Wait for some of the batch to finish before retrying
+                    running = [f for f in pending if not f.done()]
+
+                    if running:
+                        wait(running, return_when=FIRST_COMPLETED)
+                    else:
+                        time.sleep(0.1)
+
+                except Exception:
+                    self._errors += 1
+                    logger.exception("Skipped update: %.200r", update)
+                    break
+
+        wait(pending)
+
+    def poll_once(self) -> int:
+        """
+        Fetch and process a single batch of updates
+
+        Returns:
+            number of updates processed
+
+        Raises:
+            requests.RequestException: Failed to fetch updates
+            ValueError, KeyError: Invaild response from telegram
+        """
+
+        updates = self._get_updates(self.timeout, self.limit)
+
+        if updates:
+            try:
+                self._process_batch(updates)
+
+            finally:
+                # Confirmed to telegram by the next getUpdates call, a batch
+                # that cannot be processed is not fetched again
+                ids = [u.get("update_id") for u in updates if isinstance(u, dict)]
+                ids = [i for i in ids if isinstance(i, int)]
+
+                if ids:
+                    self.offset = max(ids) + 1
+
+        self._batches += 1
+        self._updates += len(updates)
+        self._last_batch_size = len(updates)
+        self._max_batch_size = max(self._max_batch_size, len(updates))
+
+        return len(updates)
+
+    def run(self) -> None:
+        """Poll until stop() is called"""
+
+        backoff = 1
+
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+                backoff = 1
+
+            except requests.RequestException as e:
+                self._errors += 1
+                logger.warning(
+                    "getUpdates failed: %s, retrying in %ss", e, backoff)
+
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+            except Exception:
+                self._errors += 1
+                logger.exception(
+                    "Polling failed, retrying in %ss", backoff)
+
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+        if self.offset is not None:
+            # Confirm the last processed batch before exiting
+            try:
+                self._get_updates(0, 1)
+            except (requests.RequestException, ValueError, KeyError):
+                pass
+
+    def stop(self) -> None:
+        """Stop polling after the current batch"""
+        self._stop.set()
+
+    def stats(self) -> dict:
+        """
+        Get counters of the poller
+
+        Returns:
+            dict of batch counters
+        """
+
+        return {
+            "offset": self.offset,
+            "batches": self._batches,
+            "updates": self._updates,
+            "last_batch_size": self._last_batch_size,
+            "max_batch_size": self._max_batch_size,
+            "errors": self._errors,
+        }
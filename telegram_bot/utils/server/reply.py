@@ -0,0 +1,104 @@
+"""
+Hand-off of a telegram method from a worker to the webhook response.
+
+The Bot API accepts a single method call as the body of the webhook
+response. The HTTP handler waits a short time for the worker handling the
+update to offer its first action, which is then written into the response
+instead of being posted. Later actions are held back until the response has
+been sent so that the replies keep their order.
+
+Modules may also return a RunCommand among their actions to have the
+server handle a command as if the user had sent it.
+
+More Infomation: https://core.telegram.org/bots/api/#making-requests-when-getting-updates
+
+"""
+import threading
+
+from typing import Optional
+
+from utils.api.methods import TelegramMethods
+
+
+class InlineReply:
+    """
+    Slot shared by the HTTP handler and the worker of one update
+
+    Attributes:
+        action: method taken to be sent in the webhook response
+    """
+
+    def __init__(self) -> None:
+        self.action: Optional[TelegramMethods] = None
+
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._sent = threading.Event()
+        self._closed = False
+
+    def offer(self, action: TelegramMethods) -> bool:
+        """
+        Offer an action to be sent in the webhook response
+
+        Returns:
+            True if the action is taken, else the caller must post it
+        """
+
+        if not action.inline_reply:
+            return False
+
+        with self._lock:
+            if self._closed or self.action is not None:
+                return False
+
+            self.action = action
+
+        self._ready.set()
+        return True
+
+    def close(self) -> None:
+        """Stop accepting actions, called when the update has been handled"""
+
+        with self._lock:
+            self._closed = True
+
+        self._ready.set()
+
+    def take(self, timeout: float) -> Optional[TelegramMethods]:
+        """
+        Wait for an action to be offered
+
+        Args:
+            timeout: max seconds to wait
+
+        Returns:
+            The offered action, None if nothing was offered in time
+        """
+
+        self._ready.wait(timeout)
+
+        with self._lock:
+            self._closed = True
+            return self.action
+
+    def sent(self) -> None:
+        """Mark the webhook response as written"""
+        self._sent.set()
+
+    def wait_sent(self, timeout: float = None) -> None:
+        """Block until the webhook response is written, if an action was taken"""
+
+        if self.action is not None:
+            self._sent.wait(timeout)
+
+
+class RunCommand:
+    """
+    Action asking the server to handle a command on behalf of the user
+
+    Attributes:
+        text: command to handle, e.g. "/weather forecast24 north"
+    """
+
+    def __init__(self, text: str) -> None:
+        self.text = text
@@ -1,6 +1,29 @@
+import time
+
 from typing import Union , Optional
 
 from core import database as db
+from utils.cache import LRUCache
+
+# Write-through cache of (last_command, require_follow_up) per chat
+_cache = LRUCache(maxsize=10000, ttl=600)
+
+
+def configure_cache(maxsize: int, ttl: float) -> None:
+    """
+    Replace the session cache
+
+    Args:
+        maxsize: max number of chats cached
+        ttl: seconds a cached state is valid for
+    """
+    global _cache
+    _cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+
+def cache_stats() -> dict:
+    """Get hit/miss/eviction counters of the session cache"""
+    return _cache.stats()
 
 
 class UserSession:
@@ -12,7 +35,24 @@ class UserSession:
         self.require_follow_up:Optional[bool] = None
         self.last_command:Optional[str] = None
 
+    def _key(self):
+        return ("usercommandstate", self.user_id, self.chat_id)
+
     def _run_query(self):
+        cached = _cache.get(self._key())
+
+        if cached is not None:
+            self.last_command, self.require_follow_up = cached
+            return
+
+        pending = db.get_deferred(self._key())
+
+        # Latest write is not committed yet
+        if pending is not None:
+            self.last_command = pending["last_command"]
+            self.require_follow_up = pending["require_follow_up"]
+            return
+
         query = db.execute("SELECT last_command,require_follow_up FROM usercommandstate WHERE user_id = :user_id AND chat_id = :chat_id", {
                            "user_id": self.user_id, "chat_id": self.chat_id})
 
@@ -22,6 +62,8 @@ class UserSession:
             self.require_follow_up = False
             self.last_command = ""
 
+        _cache.set(self._key(), (self.last_command, self.require_follow_up))
+
     def is_addl_args_required(self):
         if self.require_follow_up == None:
             self._run_query()
@@ -38,21 +80,29 @@ class UserSession:
             return ""
 
     def update_state(self, command, require_follow_up):
-        db.execute_and_commit(
+        command = str(command).strip()
+
+        db.execute_deferred(
+            self._key(),
             """
             INSERT INTO usercommandstate 
-            VALUES(:user_id,:chat_id,:last_command,:require_follow_up) 
+            (user_id,chat_id,last_command,require_follow_up,updated_at) 
+            VALUES(:user_id,:chat_id,:last_command,:require_follow_up,:updated_at) 
             ON CONFLICT(user_id,chat_id) 
             DO UPDATE SET 
             last_command=:last_command,
-            require_follow_up=:require_follow_up 
+            require_follow_up=:require_follow_up,
+            updated_at=:updated_at 
             WHERE 
             user_id = :user_id and chat_id = :chat_id
             """,
             {
                 "user_id": self.user_id,
                 "chat_id": self.chat_id,
-                "last_command": str(command).strip(),
-                "require_follow_up": require_follow_up
+                "last_command": command,
+                "require_follow_up": require_follow_up,
+                "updated_at": time.time()
             }
         )
+
+        _cache.set(self._key(), (command, require_follow_up))
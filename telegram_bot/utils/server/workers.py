@@ -0,0 +1,157 @@
+"""
+Bounded pool of worker threads used to run request handling concurrently.
+
+    Typical usage example:
+
+    pool = WorkerPool(8, max_queue=64)
+    pool.submit(handle, update)
+    pool.stats()
+
+"""
+import logging
+import queue
+import threading
+
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class PoolFullErr(Exception):
+    """Exception class raised when the pool queue is at capacity"""
+
+    def __init__(self, message="Worker queue is full", *args: object) -> None:
+        super().__init__(message, *args)
+
+
+class WorkerPool:
+    """
+    Fixed size pool of threads consuming a bounded job queue.
+
+    Attributes:
+        size: number of worker threads
+        max_queue: maximum number of jobs waiting for a worker
+    """
+
+    def __init__(self, size: int, max_queue: int = 0, name: str = "worker") -> None:
+
+        if size < 1:
+            raise ValueError("Worker pool size must be at least 1")
+
+        self.size = size
+        self.max_queue = max_queue
+        self.name = name
+
+        self._queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._threads = []
+
+        self._busy = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._max_queue_depth = 0
+
+        for i in range(size):
+            t = threading.Thread(
+                target=self._worker, name=f"{name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+
+            if job is None:
+                self._queue.task_done()
+                return
+
+            future, fn, args, kwargs = job
+
+            with self._lock:
+                self._busy += 1
+
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(fn(*args, **kwargs))
+
+            except BaseException as e:
+                logger.exception("Unhandled error in %s", self.name)
+                future.set_exception(e)
+
+                with self._lock:
+                    self._failed += 1
+
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                    self._completed += 1
+
+                self._queue.task_done()
+
+    def submit(self, fn, *args, block=False, timeout=None, **kwargs) -> Future:
+        """
+        Queue a job to be run by the pool
+
+        Args:
+            fn: callable to run
+            *args, **kwargs: arguments passed to fn
+            block (optional): wait for space in the queue if it is full
+            timeout (optional): max seconds to wait when blocking
+
+        Returns:
+            concurrent.futures.Future of the job
+
+        Raises:
+            PoolFullErr: The queue is full
+        """
+
+        future = Future()
+
+        try:
+            self._queue.put((future, fn, args, kwargs), block, timeout)
+
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise PoolFullErr
+
+        with self._lock:
+            self._submitted += 1
+            self._max_queue_depth = max(
+                self._max_queue_depth, self._queue.qsize())
+
+        return future
+
+    def shutdown(self, wait=True) -> None:
+        """Stop workers once queued jobs are completed"""
+
+        for _ in self._threads:
+            self._queue.put(None)
+
+        if wait:
+            for t in self._threads:
+                t.join()
+
+    def stats(self) -> dict:
+        """
+        Get counters of the pool
+
+        Returns:
+            dict of queue depth and worker utilisation counters
+        """
+
+        with self._lock:
+            return {
+                "workers": self.size,
+                "busy": self._busy,
+                "utilisation": round(self._busy / self.size, 3),
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "max_queue_depth": self._max_queue_depth,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+            }